@@ -0,0 +1,30 @@
+import argparse, time
+
+from lyripop.tables import read_table
+from lyripop.utils import clean_lyrics, clean_lyrics_series
+
+def best_of(fn, repeat):
+    ts = []
+    for _ in range(repeat):
+        t = time.perf_counter(); out = fn(); ts.append(time.perf_counter() - t)
+    return min(ts), out
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark scalar clean_lyrics vs batch clean_lyrics_series")
+    ap.add_argument("--lyrics_csv", default="data_out/yearend_hot100_lyrics_1958_2024.csv", help=".parquet or .csv")
+    ap.add_argument("--repeat", type=int, default=5, help="Runs per variant; the fastest is reported")
+    args = ap.parse_args()
+
+    raws = read_table(args.lyrics_csv, columns=["lyrics_raw"])["lyrics_raw"]
+    n_chars = int(raws.dropna().str.len().sum())
+    t_scalar, ref = best_of(lambda: [clean_lyrics(x) for x in raws], args.repeat)
+    t_batch, got = best_of(lambda: clean_lyrics_series(raws).tolist(), args.repeat)
+    if got != ref:
+        bad = sum(a != b for a, b in zip(got, ref))
+        raise SystemExit(f"[ERROR] clean_lyrics_series differs from clean_lyrics on {bad} rows")
+    print(f"[BENCH] {len(raws)} rows, {n_chars / 1e6:.1f}M chars; outputs identical")
+    print(f"[BENCH] scalar clean_lyrics   : {t_scalar:.3f}s")
+    print(f"[BENCH] clean_lyrics_series   : {t_batch:.3f}s ({t_scalar / t_batch:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse, os, tempfile, time
+from pathlib import Path
+import pandas as pd
+
+from lyripop.net import use_cassette
+from lyripop.charts import fetch_year_end_hot100_years
+from lyripop.lyrics import fetch_lyrics_for_chart
+from lyripop.tables import read_table
+
+def bench_lyrics(charts, workers, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        t = time.perf_counter()
+        out = fetch_lyrics_for_chart(charts, Path(tmp) / "lyrics.sqlite", workers=workers, rate=args.rate,
+                                     retries=args.retries, backoff=args.backoff)
+        dt = time.perf_counter() - t
+    return dt, int((out["lyrics_raw"] != "").sum())
+
+def bench_charts(years, workers, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        t = time.perf_counter()
+        by_year = fetch_year_end_hot100_years(years, Path(tmp), workers=workers, host_rate=args.host_rate,
+                                              host_concurrency=workers)
+        dt = time.perf_counter() - t
+    return dt, sum(len(d) for d in by_year.values())
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a recorded HTTP cassette to benchmark the fetch stages offline")
+    ap.add_argument("--cassette", required=True, help="Cassette dir recorded with LYRIPOP_CASSETTE_MODE=record")
+    ap.add_argument("--charts_csv", default=None, help="Chart rows to fetch lyrics for (lyrics stage)")
+    ap.add_argument("--start", type=int, default=None, help="First chart year (charts stage)")
+    ap.add_argument("--end", type=int, default=None)
+    ap.add_argument("--limit", type=int, default=0, help="Only the first N chart rows (0 = all)")
+    ap.add_argument("--workers", default="1,4,8", help="Comma-separated worker counts to compare")
+    ap.add_argument("--rate", type=float, default=0, help="Lyrics token-bucket rate (0 = unlimited)")
+    ap.add_argument("--host_rate", type=float, default=0, help="Charts per-host rate (0 = unlimited)")
+    ap.add_argument("--latency", type=float, default=0.0, help="Injected mean latency per request (s)")
+    ap.add_argument("--error_rate", type=float, default=0.0, help="Share of requests answered with a synthetic 503")
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument("--backoff", type=float, default=0.05)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out_csv", default=None)
+    args = ap.parse_args()
+
+    os.environ.setdefault("GENIUS_ACCESS_TOKEN", "replay")  # 回放不需要真实 token
+    charts = None
+    if args.charts_csv:
+        charts = read_table(args.charts_csv)
+        if args.limit:
+            charts = charts.head(args.limit)
+    years = range(args.start, args.end + 1) if args.start and args.end else None
+    if charts is None and years is None:
+        raise SystemExit("[ERROR] Give --charts_csv (lyrics stage) and/or --start/--end (charts stage).")
+
+    res = []
+    for w in [int(x) for x in args.workers.split(",")]:
+        for stage, run, n in (("lyrics", bench_lyrics, charts), ("charts", bench_charts, years)):
+            if n is None:
+                continue
+            cas = use_cassette(Path(args.cassette), "replay", latency=args.latency, error_rate=args.error_rate,
+                               seed=args.seed)
+            dt, got = run(n, w, args)
+            st = cas.stats; cas.close()
+            reqs = st["hits"] + st["misses"] + st["errors"]
+            res.append({"stage": stage, "workers": w, "items": len(n), "ok_items": got, "seconds": round(dt, 3),
+                        "items_per_s": round(len(n) / dt, 2), "requests": reqs, "req_per_s": round(reqs / dt, 2),
+                        "misses": st["misses"], "injected_errors": st["errors"]})
+            print(f"[BENCH] {stage:6s} workers={w:<3d} {len(n)} items in {dt:.2f}s "
+                  f"({len(n) / dt:.1f}/s, {reqs} requests, {st['misses']} misses, {st['errors']} injected errors)")
+    use_cassette(None)
+    if args.out_csv:
+        pd.DataFrame(res).to_csv(args.out_csv, index=False)
+        print(f"[OK] -> {args.out_csv}")
+
+if __name__ == "__main__":
+    main()
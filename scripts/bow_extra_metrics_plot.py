@@ -4,6 +4,7 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import zipfile
+from lyripop.tables import read_table
 
 def yearly(df, col):
     g = df.groupby("year")[col].agg(["mean","std","count"]).reset_index()
@@ -31,7 +32,7 @@ def main():
     ap.add_argument("--min_n_per_year", type=int, default=20)
     args = ap.parse_args()
 
-    df = pd.read_csv(args.hot100_bow_csv)
+    df = read_table(args.hot100_bow_csv, columns=["year", "entropy", "hhi", "max_p"])
     keep = df.groupby("year").size().reset_index(name="n")
     years = set(keep[keep["n"]>=args.min_n_per_year]["year"])
     df = df[df["year"].isin(years)].copy()
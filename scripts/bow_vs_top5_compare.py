@@ -6,6 +6,7 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import zipfile
+from lyripop.tables import read_table
 
 def yearly_mean_se(df, value_col, year_col="year"):
     g = df.groupby(year_col)[value_col].agg(["mean","std","count"]).reset_index()
@@ -39,12 +40,9 @@ def main():
     ap.add_argument("--end",   type=int, default=2011)
     args = ap.parse_args()
 
-    hot = pd.read_csv(args.hot100_bow_csv)
-    top = pd.read_csv(args.top5_metrics_csv)
-
-    # 只保留指定年份窗口
-    hot = hot[(hot["year"].between(args.start, args.end))]
-    top = top[(top["year"].between(args.start, args.end)) & (top["rank"]<=5)]
+    # 只读 year/rank/ttr，且只保留指定年份窗口（Parquet 下推到读取阶段）
+    hot = read_table(args.hot100_bow_csv, columns=["year", "ttr"], years=(args.start, args.end))
+    top = read_table(args.top5_metrics_csv, columns=["year", "rank", "ttr"], years=(args.start, args.end), ranks=(1, 5))
 
     # 只用 TTR 对齐（BoW 与 Top-5 唯一可直接对比的一致指标）
     # Hot-100(6–100) 年度均值 + 过滤每年样本量
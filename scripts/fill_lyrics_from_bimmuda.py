@@ -1,34 +1,12 @@
 import re, json, argparse
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz
-
-def norm_text(s):
-    s = (s or "").lower().strip()
-    s = s.replace("&", " and ")
-    s = re.sub(r"feat\.|featuring|with", " ", s)
-    s = re.sub(r"\([^)]*\)", " ", s)
-    s = re.sub(r'["“”‘’]', " ", s)
-    s = re.sub(r"[^a-z0-9\s']", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-ARTIST_ALIAS = {
-    "ross bagdasarian": "david seville",
-    "the weeknd": "weeknd",
-    "p!nk": "pink",
-    "ac dc": "acdc",
-    "marky mark and the funky bunch": "marky mark funky bunch",
-    "prince and the revolution": "prince",
-    "puff daddy": "diddy",
-    "jay z": "jayz",
-}
-def canon_artist(s):
-    s2 = norm_text(s)
-    return ARTIST_ALIAS.get(s2, s2)
-
-def combo_key(title, artist):
-    return f"{norm_text(title)} {canon_artist(artist)}".strip()
+from rapidfuzz import fuzz, process
+from lyripop.keys import norm_text, combo_key, combo_key_series
+from lyripop.parallel import fork_map
+from lyripop.store import source_stamp, stamp_matches
+from lyripop.tables import read_table, write_table
 
 def looks_like_lyrics(txt):
     if not txt or len(txt) < 80: return False
@@ -56,39 +34,70 @@ def load_bimmuda_metadata(broot: Path):
     meta['Year'] = pd.to_numeric(meta['Year'], errors='coerce').astype('Int64')
     meta['Position'] = pd.to_numeric(meta['Position'], errors='coerce').astype('Int64')
     meta = meta.dropna(subset=['Year','Position'])
-    meta['ck'] = meta.apply(lambda r: combo_key(r['Title'], r['Artist']), axis=1)
+    meta['ck'] = combo_key_series(meta['Title'], meta['Artist'])
     return meta
 
-def load_bimmuda_candidates(broot: Path):
-    pool = []
-    for p in broot.rglob("*.txt"):
-        if p.name.startswith("._"):
-            continue
-        try:
-            txt = p.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
-            continue
-        if not looks_like_lyrics(txt):
-            continue
-        stem = p.stem
-        parent = p.parent.name
-        grand = p.parent.parent.name if p.parent and p.parent.parent else ""
-        firstline = txt.splitlines()[0] if txt else ""
-        candidates = []
-        for c in [stem, parent, grand, firstline, f"{parent} {stem}", f"{grand} {parent} {stem}"]:
-            c = (c or "").strip()
-            if c and c not in candidates:
-                candidates.append(c)
-        disp = max(candidates, key=lambda s: len(s)) if candidates else stem
-        pool.append((disp, txt))
-    return pool
-
-def read_bimmuda_lyrics_by_pos(broot: Path, year: int, pos: int):
-    d = broot / "bimmuda_dataset" / str(year) / str(int(pos))
-    if not d.exists():
-        return None
-    cand = list(d.glob("*_lyrics.txt"))
-    for p in cand:
+class LazyLyricsPool:
+    """Global fallback pool over every *.txt under the BiMMuDa root.
+
+    Only path-derived labels and each file's first line are held in memory; a lyric
+    body is read (and checked with looks_like_lyrics) only when its label wins.
+    """
+
+    def __init__(self, broot: Path):
+        self.labels = []; self.paths = []; self._txt = {}
+        for p in broot.rglob("*.txt"):
+            if p.name.startswith("._"):
+                continue
+            try:
+                with p.open("r", encoding="utf-8", errors="ignore") as f:
+                    first = f.readline()
+            except Exception:
+                continue
+            stem = p.stem
+            parent = p.parent.name
+            grand = p.parent.parent.name if p.parent and p.parent.parent else ""
+            firstline = first.splitlines()[0] if first else ""
+            candidates = []
+            for c in [stem, parent, grand, firstline, f"{parent} {stem}", f"{grand} {parent} {stem}"]:
+                c = (c or "").strip()
+                if c and c not in candidates:
+                    candidates.append(c)
+            disp = max(candidates, key=lambda s: len(s)) if candidates else stem
+            self.labels.append(norm_text(disp)); self.paths.append(p)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def lyrics(self, j: int):
+        if j not in self._txt:
+            try:
+                txt = self.paths[j].read_text(encoding="utf-8", errors="ignore")
+            except Exception:
+                txt = None
+            self._txt[j] = txt if txt and looks_like_lyrics(txt) else None
+        return self._txt[j]
+
+    def best(self, queries, threshold, workers=1, chunk=64):
+        """(score, index) of the best-scoring file that really holds lyrics, or (-1, -1) below threshold."""
+        out = []
+        for k in range(0, len(queries), chunk):
+            sc = process.cdist(queries[k:k + chunk], self.labels, scorer=fuzz.token_set_ratio,
+                               dtype=np.float64, workers=workers)
+            for row in sc:
+                hit = (-1, -1)
+                # 按分数从高到低（同分按文件顺序）找第一个真正是歌词的文件
+                for j in np.argsort(-row, kind="stable").tolist():
+                    if row[j] < threshold:
+                        break
+                    if self.lyrics(j):
+                        hit = (float(row[j]), j)
+                        break
+                out.append(hit)
+        return out
+
+def read_first_lyrics(paths):
+    for p in paths:
         try:
             txt = p.read_text(encoding="utf-8", errors="ignore")
             if looks_like_lyrics(txt):
@@ -97,93 +106,162 @@ def read_bimmuda_lyrics_by_pos(broot: Path, year: int, pos: int):
             pass
     return None
 
+CATALOGUE_VERSION = 1
+
+class BimmudaCatalogue:
+    """Persisted lookups over a BiMMuDa root.
+
+    - metadata rows with precomputed combo keys, indexed by (year, position) and by year
+      (rebuilt only when the metadata CSV changes);
+    - `*_lyrics.txt` listings of bimmuda_dataset/<year>/<pos>/, revalidated by the
+      directory mtime instead of globbing on every lookup.
+    """
+
+    def __init__(self, broot: Path, cache_path: Path = None):
+        self.broot = broot; self.cache_path = cache_path
+        self.dirty = False
+        data = {}
+        if cache_path and cache_path.exists():
+            try:
+                data = json.loads(cache_path.read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+            if data.get("version") != CATALOGUE_VERSION or data.get("root") != str(broot.resolve()):
+                data = {}
+        meta_csv = broot / "metadata" / "bimmuda_per_song_metadata.csv"
+        if data.get("meta") is not None and stamp_matches(data.get("meta_stamp"), meta_csv):
+            rows, self.meta_stamp = data["meta"], data["meta_stamp"]
+        else:
+            meta = load_bimmuda_metadata(broot)
+            rows = [[t, a, int(y), int(p), ck] for t, a, y, p, ck in
+                    zip(meta['Title'], meta['Artist'], meta['Year'], meta['Position'], meta['ck'])]
+            self.meta_stamp = source_stamp(meta_csv); self.dirty = True
+        self.meta_rows = rows
+        self.by_pos = {}; self.by_year = {}
+        for t, a, y, p, ck in rows:
+            self.by_pos.setdefault((y, p), ck)       # 同 (年, 名次) 取第一条，与旧的 iloc[0] 一致
+            self.by_year.setdefault(y, []).append((ck, p))
+        self.dirs = data.get("dirs", {})
+
+    def __len__(self):
+        return len(self.meta_rows)
+
+    def lyric_files(self, year: int, pos: int) -> list:
+        d = self.broot / "bimmuda_dataset" / str(year) / str(int(pos))
+        try:
+            mtime = d.stat().st_mtime_ns
+        except OSError:
+            return []
+        rel = f"{year}/{int(pos)}"
+        ent = self.dirs.get(rel)
+        if not ent or ent["mtime_ns"] != mtime:
+            ent = {"mtime_ns": mtime, "files": [p.name for p in d.glob("*_lyrics.txt")]}
+            self.dirs[rel] = ent; self.dirty = True
+        return [d / n for n in ent["files"]]
+
+    def read_lyrics(self, year: int, pos: int):
+        return read_first_lyrics(self.lyric_files(year, pos))
+
+    def save(self):
+        if not (self.cache_path and self.dirty):
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"version": CATALOGUE_VERSION, "root": str(self.broot.resolve()),
+                "meta_stamp": self.meta_stamp, "meta": self.meta_rows, "dirs": self.dirs}
+        self.cache_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        self.dirty = False
+
+def score_same_year(by_year, items):
+    # fork_map worker: best (score, position) of each query among that year's metadata rows
+    out = []
+    for y, comb_q in items:
+        best_sc, best_pos = -1, None
+        for ck, pos in by_year.get(y, []):
+            sc = fuzz.token_set_ratio(comb_q, ck)
+            if sc > best_sc:
+                best_sc, best_pos = sc, pos
+        out.append((best_sc, best_pos))
+    return out
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--charts_csv", required=True)
     ap.add_argument("--bimmuda_root", required=True)
-    ap.add_argument("--out_csv", required=True)
+    ap.add_argument("--out_csv", required=True, help="lyrics table (.parquet or .csv)")
     ap.add_argument("--manual_json", default="manual_lyrics.json")
     ap.add_argument("--threshold", type=int, default=65)
     ap.add_argument("--make_missing_stubs", action="store_true")
     ap.add_argument("--report_csv", default="data_out/top5_matching_report.csv")
+    ap.add_argument("--workers", type=int, default=1, help="processes for fuzzy stages (B)/(C)")
+    ap.add_argument("--catalogue_cache", default="data_out/_cache/bimmuda_catalogue.json",
+                    help="persisted BiMMuDa metadata/file index ('' to disable)")
     args = ap.parse_args()
 
-    charts = pd.read_csv(args.charts_csv)
-    charts = charts[['year','rank','title','artist']].copy()
+    charts = read_table(args.charts_csv, columns=['year','rank','title','artist'])
     charts['year'] = pd.to_numeric(charts['year'], errors='coerce').astype('Int64')
     charts['rank'] = pd.to_numeric(charts['rank'], errors='coerce').astype('Int64')
     charts = charts.dropna(subset=['year','rank','title','artist']).sort_values(['year','rank'])
 
     broot = Path(args.bimmuda_root)
-    meta  = load_bimmuda_metadata(broot)
-    pool  = load_bimmuda_candidates(broot)
-    pool_labels = [norm_text(lbl) for lbl,_ in pool]
-    print("BiMMuDa metadata rows:", len(meta), " | candidate lyric files:", len(pool))
+    cat   = BimmudaCatalogue(broot, Path(args.catalogue_cache) if args.catalogue_cache else None)
+    pool  = LazyLyricsPool(broot)
+    # 兜底池不预读正文：这里数的是全部 *.txt，是否真是歌词要到命中时才检查
+    print("BiMMuDa metadata rows:", len(cat), " | fallback .txt files (unchecked):", len(pool))
 
-    rows = []
-    rep_rows = []
+    # 只有 1958–2022 的 Top-5 需要对齐；先做 (A)，剩下的再分批并行打分 (B)/(C)
+    todo = [(i, int(r['year']), int(r['rank']), str(r['title']), str(r['artist']))
+            for i, r in charts.iterrows() if 1958 <= int(r['year']) <= 2022 and int(r['rank']) <= 5]
+    hit = {}   # chart index -> (lyrics, source_label, match_score)
     auto_exact = 0
     auto_sameyear_fuzzy = 0
     auto_global_fuzzy = 0
 
-    for _, r in charts.iterrows():
-        y = int(r['year']); rank = int(r['rank'])
-        t = str(r['title']); a = str(r['artist'])
-        lyr = ""; src = ""
-
-        if 1958 <= y <= 2022 and rank <= 5:
-            # (A) exact by Year+Position
-            mrow = meta[(meta['Year']==y) & (meta['Position']==rank)]
-            if not mrow.empty:
-                mt, ma = mrow.iloc[0]['Title'], mrow.iloc[0]['Artist']
-                comb_q = combo_key(t, a); comb_m = combo_key(mt, ma)
-                sc = fuzz.token_set_ratio(comb_q, comb_m)  # 只是记录分数
-                txt = read_bimmuda_lyrics_by_pos(broot, y, rank)
-                if txt:
-                    lyr = txt; src = f"meta_pos:{y}-{rank}"
-                    auto_exact += 1
-                    rep_rows.append({"year": y, "rank": rank, "title": t, "artist": a,
-                                     "match_score": sc, "source_label": src})
-
-            # (B) same-year fuzzy if still empty
-            if not lyr:
-                same_year = meta[meta['Year']==y].copy()
-                if not same_year.empty:
-                    comb_q = combo_key(t, a)
-                    best_i, best_sc, best_pos = -1, -1, None
-                    for i, mr in same_year.reset_index(drop=True).iterrows():
-                        comb_m = combo_key(mr['Title'], mr['Artist'])
-                        sc = fuzz.token_set_ratio(comb_q, comb_m)
-                        if sc > best_sc:
-                            best_sc, best_i, best_pos = sc, i, int(mr['Position'])
-                    if best_sc >= args.threshold:
-                        txt = read_bimmuda_lyrics_by_pos(broot, y, best_pos)
-                        if txt:
-                            lyr = txt; src = f"meta_year_fuzzy:{y}-{best_pos}"
-                            auto_sameyear_fuzzy += 1
-                            rep_rows.append({"year": y, "rank": rank, "title": t, "artist": a,
-                                             "match_score": best_sc, "source_label": src})
-
-            # (C) global fallback if still empty
-            if not lyr and pool:
-                q = norm_text(f"{t} {a}")
-                best_j, best_sc = -1, -1
-                for j, lbl in enumerate(pool_labels):
-                    sc = fuzz.token_set_ratio(q, lbl)
-                    if sc > best_sc:
-                        best_sc, best_j = sc, j
-                if best_sc >= args.threshold:
-                    lyr = pool[best_j][1]; src = "fallback_pool"
-                    auto_global_fuzzy += 1
-                    rep_rows.append({"year": y, "rank": rank, "title": t, "artist": a,
-                                     "match_score": best_sc, "source_label": src})
-
-            # 即便没命中也记录一条
-            if not lyr:
-                rep_rows.append({"year": y, "rank": rank, "title": t, "artist": a,
-                                 "match_score": -1, "source_label": ""})
-
-        rows.append({**r.to_dict(), "lyrics_raw": lyr, "lyrics_url": ""})
+    # (A) exact by Year+Position
+    need_b = []
+    for i, y, rank, t, a in todo:
+        ck = cat.by_pos.get((y, rank))
+        if ck is not None:
+            sc = fuzz.token_set_ratio(combo_key(t, a), ck)  # 只是记录分数
+            txt = cat.read_lyrics(y, rank)
+            if txt:
+                hit[i] = (txt, f"meta_pos:{y}-{rank}", sc)
+                auto_exact += 1
+                continue
+        need_b.append((i, y, rank, t, a))
+
+    # (B) same-year fuzzy if still empty
+    need_c = []
+    b_best = fork_map(score_same_year, [(y, combo_key(t, a)) for _, y, _, t, a in need_b],
+                      shared=cat.by_year, workers=args.workers)
+    for (i, y, rank, t, a), (best_sc, best_pos) in zip(need_b, b_best):
+        if best_sc >= args.threshold:
+            txt = cat.read_lyrics(y, best_pos)
+            if txt:
+                hit[i] = (txt, f"meta_year_fuzzy:{y}-{best_pos}", best_sc)
+                auto_sameyear_fuzzy += 1
+                continue
+        need_c.append((i, y, rank, t, a))
+
+    # (C) global fallback if still empty
+    if len(pool):
+        c_best = pool.best([norm_text(f"{t} {a}") for _, _, _, t, a in need_c], args.threshold,
+                           workers=args.workers)
+        for (i, *_), (best_sc, best_j) in zip(need_c, c_best):
+            if best_j >= 0:
+                hit[i] = (pool.lyrics(best_j), "fallback_pool", best_sc)
+                auto_global_fuzzy += 1
+
+    cat.save()
+
+    rows = []
+    rep_rows = []
+    for i, y, rank, t, a in todo:
+        lyr, src, sc = hit.get(i, ("", "", -1))
+        # 即便没命中也记录一条
+        rep_rows.append({"year": y, "rank": rank, "title": t, "artist": a,
+                         "match_score": sc, "source_label": src})
+    for i, r in charts.iterrows():
+        rows.append({**r.to_dict(), "lyrics_raw": hit.get(i, ("",))[0], "lyrics_url": ""})
 
     # Merge manual 2023–2024 Top-5
     mfp = Path(args.manual_json)
@@ -212,8 +290,7 @@ def main():
                 manual_hits += 1
 
     out = pd.DataFrame(rows)
-    Path(args.out_csv).parent.mkdir(parents=True, exist_ok=True)
-    out.to_csv(args.out_csv, index=False)
+    write_table(out, args.out_csv)
     print("Wrote ->", args.out_csv, "rows:", len(out))
 
     # Save report
@@ -1,20 +1,10 @@
 import argparse, glob, os, re
 from pathlib import Path
-import pandas as pd
+import numpy as np
 from rapidfuzz import fuzz
-
-def norm(s):
-    s = (s or "").lower().strip()
-    s = s.replace("&", " and ")
-    s = re.sub(r"feat\.|featuring|with", " ", s)
-    s = re.sub(r"\([^)]*\)", " ", s)
-    s = re.sub(r'["“”‘’]', " ", s)
-    s = re.sub(r"[^a-z0-9\s']", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def key_combo(title, artist):
-    return f"{norm(title)} {norm(artist)}".strip()
+from lyripop.keys import text_key, text_key_series
+from lyripop.parallel import fork_map
+from lyripop.tables import find_table, read_table, write_table
 
 def _clean_field(x: str) -> str:
     # 把多连下划线视作空格，清掉多余空格
@@ -49,66 +39,88 @@ def parse_stub_name(fn):
 
     return None
 
+def score_stubs(shared, fps):
+    # fork_map worker: (status, year, text, stub key, scores vs the same-year candidate rows) per stub file
+    cand_combos, cand_years = shared
+    out = []
+    for fp in fps:
+        parsed = parse_stub_name(fp)
+        if not parsed:
+            out.append(("bad_name", None, None, None, None))
+            continue
+        y, a_stub, t_stub = parsed
+        txt = Path(fp).read_text(encoding="utf-8", errors="ignore")
+        if not txt.strip():
+            out.append(("empty", y, None, None, None))
+            continue
+        combo_stub = text_key(t_stub, a_stub)
+        same = np.flatnonzero(cand_years == y)
+        out.append(("ok", y, txt, combo_stub, [fuzz.token_set_ratio(combo_stub, cand_combos[j]) for j in same]))
+    return out
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--lyrics_csv", required=True)
+    ap.add_argument("--lyrics_csv", required=True, help="lyrics table (.parquet or .csv), rewritten in place")
     ap.add_argument("--stubs_dir",   default="manual_top5_missing")
     ap.add_argument("--threshold",   type=int, default=75)  # 略放宽，适配“清洗后标题”
+    ap.add_argument("--workers",     type=int, default=1, help="processes for scoring stubs")
     args = ap.parse_args()
 
-    df = pd.read_csv(args.lyrics_csv)
+    path = find_table(args.lyrics_csv)
+    df = read_table(path)
     # 只填 Top-5（1958–2022）且 lyrics_raw 为空的行
     cand = df[(df["rank"]<=5) & (df["year"].between(1958,2022)) & (df["lyrics_raw"].fillna("")=="")].copy()
     if cand.empty:
         print("No empty Top-5 rows to fill. Done.")
         return
 
-    cand["combo"] = cand.apply(lambda r: key_combo(r["title"], r["artist"]), axis=1)
+    cand["combo"] = text_key_series(cand["title"], cand["artist"])
+
+    # 打分可并行（每个 stub 只对同年候选行打分）；认领顺序仍按文件顺序串行决定，结果与串行一致
+    fps = glob.glob(os.path.join(args.stubs_dir, "*.txt"))
+    combos = cand["combo"].tolist(); years = cand["year"].to_numpy(); rows = cand.index.to_numpy()
+    scored = fork_map(score_stubs, fps, shared=(combos, years), workers=args.workers)
+    alive = np.ones(len(cand), dtype=bool)
 
     filled = 0; tried = 0
-    for fp in glob.glob(os.path.join(args.stubs_dir, "*.txt")):
+    for fp, (status, y, txt, combo_stub, same_scores) in zip(fps, scored):
         tried += 1
-        parsed = parse_stub_name(fp)
-        if not parsed:
+        if status == "bad_name":
             print("Skip (bad name):", fp)
             continue
-        y, a_stub, t_stub = parsed
-
-        txt = Path(fp).read_text(encoding="utf-8", errors="ignore")
-        if not txt.strip():
+        if status == "empty":
             print("Skip (empty text):", fp)
             continue
 
-        combo_stub = key_combo(t_stub, a_stub)
-
-        # 先同年，再全局
-        pool = cand[cand["year"]==y].copy()
-        if pool.empty:
-            pool = cand.copy()
+        # 先同年，再全局（同年已无候选时才对全部剩余行打分）
+        scores = np.full(len(cand), -1.0)
+        pool = alive & (years == y)
+        if not pool.any():
+            pool = alive
             scope = "global"
+            for j in np.flatnonzero(pool):
+                scores[j] = fuzz.token_set_ratio(combo_stub, combos[j])
         else:
             scope = f"year={y}"
+            scores[years == y] = same_scores
 
-        if pool.empty:
+        if not pool.any():
             print("No candidate pool for", fp); 
             continue
 
-        best_i = None; best_sc = -1
-        for i, row in pool.iterrows():
-            sc = fuzz.token_set_ratio(combo_stub, row["combo"])
-            if sc > best_sc:
-                best_sc, best_i = sc, i
+        j = int(np.argmax(np.where(pool, scores, -1)))
+        best_sc = scores[j]
 
-        if best_sc >= args.threshold and best_i is not None:
-            idx = int(pool.loc[best_i].name)  # 原 df 的索引
+        if best_sc >= args.threshold:
+            idx = int(rows[j])  # 原 df 的索引
             df.at[idx, "lyrics_raw"] = txt
             filled += 1
-            cand = cand.drop(index=idx, errors="ignore")
+            alive[j] = False
             print(f"[OK] match {scope}: score={best_sc} -> row {idx}")
         else:
             print(f"[WARN] no good match ({scope}) for {fp} (best={best_sc})")
 
-    df.to_csv(args.lyrics_csv, index=False)
+    write_table(df, path)
     print(f"Filled rows: {filled} / stubs tried: {tried}")
     remaining = df[(df["rank"]<=5) & (df["year"].between(1958,2022)) & (df["lyrics_raw"].fillna("")=="")]
     print("Remaining true-missing Top-5:", len(remaining))
@@ -1,59 +1,26 @@
-import re, argparse
+import re, sys, argparse
 from pathlib import Path
+import numpy as np
 import pandas as pd
-
-def norm(s):
-    s = (s or "").lower()
-    s = s.replace("&", " and ")
-    s = re.sub(r"(feat\.|featuring|with)", " ", s)
-    s = re.sub(r"[^a-z0-9\s']", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def first_word(s):
-    s = norm(s)
-    return s.split(" ")[0] if s else ""
-
-def combo_key(title, artist):
-    return f"{norm(title)} {norm(artist)}".strip()
-
-def load_mxm_bow_one(txt_path: Path):
-    vocab = []
-    bow = {}
-    with txt_path.open("r", encoding="utf-8", errors="ignore") as f:
-        # read vocab line (starts with '#')
-        for line in f:
-            if not line:
-                continue
-            if line.startswith("#"):
-                parts = [p.strip() for p in line[1:].strip().split(",") if p.strip()]
-                for p in parts:
-                    vocab.append(p.split(":", 1)[-1])
-                break
-        # read bow lines
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("%"):
-                continue
-            if "," not in line:
-                continue
-            tid, rest = line.split(",", 1)
-            pairs = [seg for seg in rest.split(",") if ":" in seg]
-            if pairs:
-                bow[tid] = pairs
-    if not bow:
-        raise RuntimeError(f"Failed to parse {txt_path}. Is it the unzipped txt?")
-    return vocab, bow
-
-def load_mxm_bow(train_path: Path, test_path: Path|None):
-    v1, b1 = load_mxm_bow_one(train_path)
-    total = len(b1)
+from lyripop.keys import norm_mxm, key_series, mxm_key_series
+from lyripop.mxm import open_mxm_bow, stream_mxm_bow
+from lyripop.matching import (MatchIndex, MatchCache, best_matches, cached_topk,
+                              save_matches_table, open_matches_table)
+from lyripop.store import source_stamp
+from lyripop.tables import read_table, write_table
+
+def load_mxm_bow(train_path: Path, test_path: Path|None, rebuild_cache=False, wanted=None, workers=1):
+    paths = [train_path]
     if test_path and test_path.exists():
-        v2, b2 = load_mxm_bow_one(test_path)
-        # 合并两个字典（后者覆盖前者同 id）
-        b1.update(b2)
-        total = len(b1)
-    any_key = next(iter(b1))
+        paths.append(test_path)
+    if wanted is not None:
+        # 低内存模式：流式扫描 txt，只留下已匹配到的曲目
+        b1 = stream_mxm_bow(paths, wanted, workers=workers)
+    else:
+        # 二进制 CSR 缓存（首次解析后 mmap 打开）；多个文件时后者覆盖前者同 id
+        b1 = open_mxm_bow(paths, rebuild=rebuild_cache, workers=workers)
+    total = len(b1)
+    any_key = next(iter(b1), "")
     id_hint = "MSD(TR…)" if any_key.startswith("TR") else ("MXM" if any_key.upper().startswith("MXM") else "unknown")
     print(f"[OK] Loaded BoW tracks (merged): {total}  (ID type hint: {id_hint})")
     return b1
@@ -105,110 +72,125 @@ def load_matches(matches_path: Path, sample_lines=2000):
     df = pd.DataFrame(rows, columns=["msd_id","mxm_tid","artist_mxm","title_mxm"])
     if df.empty:
         raise RuntimeError("Failed to parse mxm_779k_matches.txt — content/encoding looks wrong.")
-    df["artist_key"] = df["artist_mxm"].map(norm)
-    df["title_key"]  = df["title_mxm"].map(norm)
-    df["first_artist_initial"] = df["artist_key"].map(lambda s: s[:1] if s else "")
-    df["first_title_word"] = df["title_key"].map(first_word)
-    df["mkey"] = df.apply(lambda r: f"{r['title_key']} {r['artist_key']}".strip(), axis=1)
+    df["artist_key"] = key_series(df["artist_mxm"], norm_mxm)
+    df["title_key"]  = key_series(df["title_mxm"], norm_mxm)
+    df["mkey"] = (df["title_key"] + " " + df["artist_key"]).str.strip()
     print(f"[OK] Parsed matches rows: {len(df)}")
     return df
 
-def build_indices(mm: pd.DataFrame):
-    idx_artist_init = {}; idx_title_first = {}
-    for i, r in mm.iterrows():
-        a0 = r["first_artist_initial"]; t0 = r["first_title_word"]
-        idx_artist_init.setdefault(a0, []).append(i)
-        idx_title_first.setdefault(t0, []).append(i)
-    return idx_artist_init, idx_title_first
-
-def candidate_rows(mm, a0, t0, idx_artist_init, idx_title_first, cap=3000):
-    c1 = set(idx_artist_init.get(a0, []))
-    c2 = set(idx_title_first.get(t0, []))
-    inter = list(c1 & c2)
-    if not inter:
-        inter = list((c1 | c2))[:cap]
-    if not inter:
-        inter = list(range(min(cap, len(mm))))
-    return mm.loc[inter]
-
-def bow_stats(pairs):
-    total = 0; counts = []
-    for pc in pairs:
-        try:
-            _, c = pc.split(":")
-            c = int(c)
-            if c > 0:
-                counts.append(c); total += c
-        except Exception:
-            pass
-    if total == 0:
-        return dict(total=0, ttr=0.0, entropy=0.0, hhi=0.0, max_p=0.0)
-    import math
-    ps = [c/total for c in counts]
-    entropy = -sum(p*math.log(p+1e-12) for p in ps)
-    hhi = sum(p*p for p in ps)
-    max_p = max(ps)
-    ttr = len(counts)/total
-    return dict(total=total, ttr=ttr, entropy=entropy, hhi=hhi, max_p=max_p)
+def matches_index_dir(matches_path: Path) -> Path:
+    return matches_path.with_name(f"{matches_path.stem}_index")
+
+def build_matches_index(matches_path: Path, index_dir: Path):
+    mm = load_matches(matches_path)
+    mindex = MatchIndex.build(mm["mkey"].to_numpy(dtype=object))
+    save_matches_table(index_dir, mm, mindex, {"source": source_stamp(matches_path)})
+    print(f"[OK] Matches index ({len(mm)} rows, {len(mindex.vocab)} tokens) -> {index_dir}")
+
+def load_matches_index(matches_path: Path, index_dir: Path = None, rebuild=False):
+    # 解析 + 归一化 + 倒排索引只在源文件变化时重建，其余时候 mmap 打开
+    index_dir = index_dir or matches_index_dir(matches_path)
+    mm = None if rebuild else open_matches_table(index_dir, matches_path)
+    if mm is None:
+        build_matches_index(matches_path, index_dir)
+        mm = open_matches_table(index_dir, matches_path)
+    print(f"[OK] Loaded matches index: {len(mm)} rows")
+    return mm
+
+def build_matches_index_main(argv):
+    ap = argparse.ArgumentParser(prog="mxm_hot100_compare.py build-matches-index")
+    ap.add_argument("--mxm_matches", required=True)
+    ap.add_argument("--index_dir", default="", help="default: <matches stem>_index next to the txt")
+    ap.add_argument("--force", action="store_true", help="rebuild even if the source is unchanged")
+    args = ap.parse_args(argv)
+    src = Path(args.mxm_matches)
+    load_matches_index(src, Path(args.index_dir) if args.index_dir else None, rebuild=args.force)
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "build-matches-index":
+        return build_matches_index_main(sys.argv[2:])
     ap = argparse.ArgumentParser()
     ap.add_argument("--yearend_csv", required=True)
     ap.add_argument("--mxm_matches", required=True)
     ap.add_argument("--mxm_dataset", required=True)      # train
     ap.add_argument("--mxm_dataset2", default="", help="mxm_dataset_test.txt (optional)")  # test
-    ap.add_argument("--out_csv", default="data_out/hot100_bow_1991_2024.csv")
+    ap.add_argument("--out_csv", default="data_out/hot100_bow_1991_2024.parquet", help=".parquet or .csv")
     ap.add_argument("--start", type=int, default=1991)
     ap.add_argument("--end", type=int, default=2024)
     ap.add_argument("--threshold", type=int, default=76)     # 略放宽
     ap.add_argument("--limit_per_query", type=int, default=3000) # 候选池更大
+    ap.add_argument("--topk", type=int, default=5, help="candidates kept per chart row (for threshold sweeps)")
+    ap.add_argument("--candidates_csv", default="", help="optional: write the top-k candidates + scores per chart row")
+    ap.add_argument("--all_tracks_csv", default="", help="also write BoW metrics for every MXM track")
+    ap.add_argument("--match_cache", default="data_out/_cache/mxm_match_cache.sqlite",
+                    help="persistent per-query top-k store ('' to disable)")
+    ap.add_argument("--matches_index", default="", help="matches index dir (default: <matches stem>_index)")
+    ap.add_argument("--stream_bow", action="store_true",
+                    help="low-memory mode: match first, then stream the BoW txt keeping only matched tracks")
+    ap.add_argument("--workers", type=int, default=1, help="processes for matching chart rows and parsing the MXM txt files")
+    ap.add_argument("--rebuild_bow_cache", action="store_true", help="force re-parsing the MXM txt into the binary cache")
     args = ap.parse_args()
+    if args.stream_bow and args.all_tracks_csv:
+        raise SystemExit("--all_tracks_csv needs the full BoW cache; drop --stream_bow.")
 
-    charts = pd.read_csv(args.yearend_csv)
-    charts = charts[(charts["year"].between(args.start, args.end)) & (charts["rank"].between(6,100))].copy()
+    # 保留榜单的全部列（peakPos/weeks/image 等随输出透传）；Parquet 只读窗口内的 row group，CSV 读完再筛
+    charts = read_table(args.yearend_csv, years=(args.start, args.end), ranks=(6, 100))
     if charts.empty:
         raise RuntimeError("No rows in the given year/rank range — check --start/--end and input CSV.")
-    charts["qkey"] = charts.apply(lambda r: combo_key(r["title"], r["artist"]), axis=1)
-    charts["a0"] = charts["artist"].map(lambda s: norm(s)[:1] if s else "")
-    charts["t0"] = charts["title"].map(first_word)
-
-    mm = load_matches(Path(args.mxm_matches))
-    idx_artist_init, idx_title_first = build_indices(mm)
-    bow = load_mxm_bow(Path(args.mxm_dataset), Path(args.mxm_dataset2) if args.mxm_dataset2 else None)
-    bow_keys = set(bow.keys())
-
-    try:
-        from rapidfuzz import fuzz
-    except Exception:
-        raise SystemExit("Please install rapidfuzz:  conda install -c conda-forge rapidfuzz  (or pip install rapidfuzz)")
+    charts["qkey"] = mxm_key_series(charts["title"], charts["artist"])
+
+    mm = load_matches_index(Path(args.mxm_matches), Path(args.matches_index) if args.matches_index else None)
+    # 倒排索引取候选 + rapidfuzz 批量打分，保留每行 top-k，阈值只在这里筛
+    # 已打过分的 qkey（同一索引版本 + 候选上限）直接复用，只对新 query 打分
+    cache = MatchCache(Path(args.match_cache)) if args.match_cache else None
+    cand_rows, cand_scores = cached_topk(mm.index, charts["qkey"].tolist(), k=args.topk,
+                                         limit=args.limit_per_query, cache=cache, version=mm.version,
+                                         workers=args.workers)
+    if cache:
+        cache.close()
+    if args.candidates_csv:
+        cdf = pd.DataFrame({"year": np.repeat(charts["year"].to_numpy(), args.topk),
+                            "rank": np.repeat(charts["rank"].to_numpy(), args.topk),
+                            "qkey": np.repeat(charts["qkey"].to_numpy(), args.topk),
+                            "cand": np.tile(np.arange(args.topk), len(charts)),
+                            "mm_row": cand_rows.ravel(), "match_score": cand_scores.ravel()})
+        cdf = cdf[cdf["mm_row"] >= 0]
+        cdf["mkey"] = mm["mkey"].take(cdf["mm_row"].to_numpy())
+        write_table(cdf, args.candidates_csv)
+    best = best_matches(cand_rows, cand_scores, args.threshold)
+
+    wanted = None
+    if args.stream_bow:
+        wanted = {mm[c][int(i)] for i in best[best >= 0] for c in ("msd_id", "mxm_tid")}
+    bow = load_mxm_bow(Path(args.mxm_dataset), Path(args.mxm_dataset2) if args.mxm_dataset2 else None,
+                       rebuild_cache=args.rebuild_bow_cache, wanted=wanted, workers=args.workers)
 
     recs = []
-    for _, r in charts.iterrows():
-        q = r["qkey"]; a0 = r["a0"]; t0 = r["t0"]
-        cand = candidate_rows(mm, a0, t0, idx_artist_init, idx_title_first, cap=args.limit_per_query)
-        best_idx, best_sc = None, -1
-        for i, mr in cand.iterrows():
-            sc = fuzz.token_set_ratio(q, mr["mkey"])
-            if sc > best_sc:
-                best_sc = sc; best_idx = i
-        if best_idx is not None and best_sc >= args.threshold:
-            mr = mm.loc[best_idx]
+    for (_, r), best_idx, best_sc in zip(charts.iterrows(), best, cand_scores[:, 0]):
+        if best_idx >= 0:
+            mr = mm.row(best_idx)
             # 关键：BoW 的键可能是 TR（MSD）或 MXM，谁存在用谁
-            tid = mr["msd_id"] if mr["msd_id"] in bow_keys else (mr["mxm_tid"] if mr["mxm_tid"] in bow_keys else None)
+            tid = mr["msd_id"] if mr["msd_id"] in bow else (mr["mxm_tid"] if mr["mxm_tid"] in bow else None)
             if tid:
-                pairs = bow.get(tid)
-                if pairs:
-                    stats = bow_stats(pairs)
-                    recs.append({**r.to_dict(), **stats,
-                                 "bow_tid": tid, "match_score": best_sc,
-                                 "artist_mxm": mr["artist_mxm"], "title_mxm":  mr["title_mxm"]})
+                recs.append({**r.to_dict(),
+                             "bow_tid": tid, "match_score": best_sc,
+                             "artist_mxm": mr["artist_mxm"], "title_mxm":  mr["title_mxm"]})
 
     out = pd.DataFrame(recs)
-    Path(args.out_csv).parent.mkdir(parents=True, exist_ok=True)
-    out.to_csv(args.out_csv, index=False)
+    if len(out):
+        # 所有命中的曲目一次性向量化计算（见 lyripop.mxm.bow_metrics），插在 bow_tid 之前
+        stats = bow.metrics(out["bow_tid"]).drop(columns="bow_tid")
+        pos = out.columns.get_loc("bow_tid")
+        out = pd.concat([out.iloc[:, :pos], stats, out.iloc[:, pos:]], axis=1)
+    write_table(out, args.out_csv)
     print("Saved:", args.out_csv, "| rows:", len(out))
     if len(out):
         print(out.groupby("year")["ttr"].mean().head())
 
+    if args.all_tracks_csv:
+        allm = bow.metrics()
+        write_table(allm, args.all_tracks_csv)
+        print("Saved:", args.all_tracks_csv, "| MXM tracks:", len(allm))
+
 if __name__ == "__main__":
     main()
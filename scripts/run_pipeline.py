@@ -1,14 +1,139 @@
 #!/usr/bin/env python3
-import subprocess, shlex, os
+import argparse, os, re, sys
 from pathlib import Path
 
-def run(cmd):
-    print(f"$ {cmd}")
-    subprocess.check_call(shlex.split(cmd))
-
 root = Path(__file__).resolve().parent.parent
-os.chdir(root)
+sys.path.insert(0, str(root / "src"))
+from lyripop.dag import Stage, run_stages
+from lyripop.tables import FORMATS, find_table
+
+PKG = root / "src" / "lyripop"
+IMPORT_RE = re.compile(r"^from (?:\.|lyripop\.)(\w+) import", re.M)
+
+def code_for(*files) -> list:
+    """The given sources plus every lyripop module they import, transitively."""
+    seen = []; todo = [Path(f) for f in files]
+    while todo:
+        fp = todo.pop()
+        if fp in seen or not fp.exists():
+            continue
+        seen.append(fp)
+        todo += [PKG / f"{m}.py" for m in IMPORT_RE.findall(fp.read_text(encoding="utf-8"))]
+    return sorted(seen)
+
+def build_stages(args) -> list:
+    out = Path(args.outdir); py = sys.executable; w = str(args.workers)
+    span = f"{args.start}_{args.end}"; bspan = f"{args.bow_start}_{args.bow_end}"
+    fmt = args.format
+    # 本次由某个 stage 产出的表用 --format；只作为源文件的表沿用磁盘上已有的格式
+    charts_tbl = out / f"yearend_hot100_{span}.{fmt}"
+    if not args.fetch_charts:
+        charts_tbl = find_table(charts_tbl)
+    lyrics_tbl = out / f"yearend_hot100_lyrics_{span}.{fmt}"
+    if not (args.fetch_lyrics or args.bimmuda_root):
+        lyrics_tbl = find_table(lyrics_tbl)
+    top5_tbl = out / f"top5_metrics.{fmt}"
+    bow_tbl = out / f"hot100_bow_{bspan}.{fmt}"
+    pipe = [py, "-m", "lyripop.pipeline", "--outdir", out, "--start", args.start, "--end", args.end, "--workers", w,
+            "--format", fmt]
+    script = lambda name: root / "scripts" / name
+    stages = []
+
+    # 抓取类 stage 需要网络，默认不跑：已有的表直接当作源文件
+    if args.fetch_charts:
+        stages.append(Stage("charts", pipe + ["--fetch_charts"], outputs=[charts_tbl],
+                            code=code_for(PKG / "pipeline.py", PKG / "charts.py")))
+    if args.fetch_lyrics:
+        stages.append(Stage("lyrics", pipe + ["--fetch_lyrics"], inputs=[charts_tbl], outputs=[lyrics_tbl],
+                            code=code_for(PKG / "pipeline.py", PKG / "lyrics.py")))
+    if args.bimmuda_root:
+        broot = Path(args.bimmuda_root)
+        stages.append(Stage("bimmuda",
+                            [py, script("fill_lyrics_from_bimmuda.py"), "--charts_csv", charts_tbl,
+                             "--bimmuda_root", args.bimmuda_root, "--out_csv", lyrics_tbl,
+                             "--manual_json", args.manual_json, "--threshold", args.bimmuda_threshold,
+                             "--report_csv", out / "top5_matching_report.csv", "--workers", w],
+                            # 只盯元数据 CSV 和到 bimmuda_dataset/<年>/<名次>/ 为止的目录 mtime，不遍历每个文件
+                            inputs=[charts_tbl, broot / "metadata" / "bimmuda_per_song_metadata.csv",
+                                    Path(args.manual_json)],
+                            trees={broot: 3},
+                            outputs=[lyrics_tbl, out / "top5_matching_report.csv"],
+                            code=code_for(script("fill_lyrics_from_bimmuda.py"))))
+    if Path(args.stubs_dir).is_dir():
+        # 原地改写 lyrics_tbl：既是输入也是输出
+        stages.append(Stage("stubs",
+                            [py, script("merge_manual_stubs.py"), "--lyrics_csv", lyrics_tbl,
+                             "--stubs_dir", args.stubs_dir, "--threshold", args.stubs_threshold, "--workers", w],
+                            inputs=[lyrics_tbl, Path(args.stubs_dir)], outputs=[lyrics_tbl],
+                            code=code_for(script("merge_manual_stubs.py"))))
+    stages.append(Stage("metrics", pipe + ["--compute"], inputs=[lyrics_tbl],
+                        outputs=[out / f"yearend_hot100_metrics_{span}.{fmt}", top5_tbl,
+                                 out / f"non_top5_metrics.{fmt}"],
+                        code=code_for(PKG / "pipeline.py", PKG / "metrics.py")))
+    prefix = out / f"top5_extra_{span}"
+    stages.append(Stage("top5_extra",
+                        [py, script("top5_extra_from_lyrics.py"), "--lyrics_csv", lyrics_tbl, "--out_prefix", prefix,
+                         "--start", args.start, "--end", args.end],
+                        inputs=[lyrics_tbl], outputs=[Path(f"{prefix}_bundle.zip")],
+                        code=code_for(script("top5_extra_from_lyrics.py"))))
+
+    mxm = Path(args.mxm_dir)
+    matches, train, test = mxm / "mxm_779k_matches.txt", mxm / "mxm_dataset_train.txt", mxm / "mxm_dataset_test.txt"
+    if matches.exists() and train.exists():
+        cmd = [py, script("mxm_hot100_compare.py"), "--yearend_csv", charts_tbl, "--mxm_matches", matches,
+               "--mxm_dataset", train, "--out_csv", bow_tbl, "--start", args.bow_start, "--end", args.bow_end,
+               "--threshold", args.bow_threshold, "--workers", w]
+        if test.exists():
+            cmd += ["--mxm_dataset2", test]
+        stages.append(Stage("bow", cmd, inputs=[charts_tbl, matches, train] + ([test] if test.exists() else []),
+                            outputs=[bow_tbl], code=code_for(script("mxm_hot100_compare.py"))))
+        prefix = out / f"hot100_bow_{bspan}_extra"
+        stages.append(Stage("bow_extra",
+                            [py, script("bow_extra_metrics_plot.py"), "--hot100_bow_csv", bow_tbl, "--out_prefix", prefix],
+                            inputs=[bow_tbl], outputs=[Path(f"{prefix}_bundle.zip")],
+                            code=code_for(script("bow_extra_metrics_plot.py"))))
+        prefix = out / f"bow_vs_top5_{bspan}"
+        stages.append(Stage("bow_vs_top5",
+                            [py, script("bow_vs_top5_compare.py"), "--hot100_bow_csv", bow_tbl,
+                             "--top5_metrics_csv", top5_tbl, "--out_prefix", prefix,
+                             "--start", args.bow_start, "--end", args.bow_end],
+                            inputs=[bow_tbl, top5_tbl], outputs=[Path(f"{prefix}_bundle.zip")],
+                            code=code_for(script("bow_vs_top5_compare.py"))))
+    return stages
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the pipeline stages that are out of date (charts -> lyrics -> "
+                                             "BiMMuDa fill -> stubs -> metrics -> BoW compare -> plots/bundles)")
+    ap.add_argument("--outdir", default="data_out")
+    ap.add_argument("--start", type=int, default=1958)
+    ap.add_argument("--end", type=int, default=2024)
+    ap.add_argument("--fetch_charts", action="store_true", help="Fetch the year-end charts (network)")
+    ap.add_argument("--fetch_lyrics", action="store_true", help="Fetch lyrics from Genius (network, token)")
+    ap.add_argument("--bimmuda_root", default="", help="Fill Top-5 lyrics from a local BiMMuDa checkout")
+    ap.add_argument("--manual_json", default="manual_lyrics.json")
+    ap.add_argument("--bimmuda_threshold", type=int, default=60)
+    ap.add_argument("--stubs_dir", default="manual_top5_missing")
+    ap.add_argument("--stubs_threshold", type=int, default=78)
+    ap.add_argument("--mxm_dir", default="data_mxm", help="BoW stages run when the MXM matches + train txt are here")
+    ap.add_argument("--bow_start", type=int, default=1991)
+    ap.add_argument("--bow_end", type=int, default=2011)
+    ap.add_argument("--bow_threshold", type=int, default=76)
+    ap.add_argument("--format", choices=FORMATS, default="parquet", help="Format of the tables the stages write")
+    ap.add_argument("--workers", type=int, default=1, help="Processes per stage (passed to each step)")
+    ap.add_argument("--jobs", type=int, default=2, help="Independent stages run at the same time")
+    ap.add_argument("--force", default="", help="Comma-separated stages to rerun anyway ('all' for every stage)")
+    ap.add_argument("--dry_run", action="store_true", help="Only list the stages that would run")
+    args = ap.parse_args()
+    if args.fetch_lyrics and args.bimmuda_root:
+        raise SystemExit("[ERROR] --fetch_lyrics and --bimmuda_root both write the lyrics table; pick one.")
+
+    os.chdir(root)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root / "src"), os.getenv("PYTHONPATH")])))
+    out = Path(args.outdir)
+    status = run_stages(build_stages(args), out / "_cache" / "dag_state.json", out / "_logs", jobs=args.jobs,
+                        force=[s for s in args.force.split(",") if s], dry_run=args.dry_run, cwd=root, env=env)
+    if any(s in ("failed", "blocked") for s in status.values()):
+        raise SystemExit(1)
 
-run("python -m lyripop.pipeline --fetch_charts --start 1980 --end 2024")
-run("python -m lyripop.pipeline --fetch_lyrics --start 1980 --end 2024")
-run("python -m lyripop.pipeline --compute      --start 1980 --end 2024")
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-import time, re, requests
+import argparse, re
 from io import StringIO
 from pathlib import Path
 import pandas as pd
 
+from lyripop.charts import fetch_years_cached
+from lyripop.tables import write_table
+
 UA = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"}
 
 def clean_title(s: str) -> str:
@@ -25,11 +28,11 @@ def pick_year_table(tables):
                 return t
     return None
 
-def parse_year(year: int) -> pd.DataFrame:
-    url = f"https://en.wikipedia.org/wiki/Billboard_Year-End_Hot_100_singles_of_{year}"
-    r = requests.get(url, headers=UA, timeout=30)
-    r.raise_for_status()
-    tables = pd.read_html(StringIO(r.text))  # 走 lxml 解析
+def wiki_url(year: int) -> str:
+    return f"https://en.wikipedia.org/wiki/Billboard_Year-End_Hot_100_singles_of_{year}"
+
+def parse_year(year: int, html: str) -> pd.DataFrame:
+    tables = pd.read_html(StringIO(html))  # 走 lxml 解析
     tbl = pick_year_table(tables)
     if tbl is None:
         raise RuntimeError(f"No suitable table for {year}")
@@ -70,21 +73,24 @@ def parse_year(year: int) -> pd.DataFrame:
     return out
 
 def main():
-    outdir = Path("data_out"); outdir.mkdir(parents=True, exist_ok=True)
-    rows = []
-    for y in range(1958, 2024+1):
-        try:
-            dfy = parse_year(y)
-            rows.append(dfy)
-            print(f"[OK] {y}: {len(dfy)} rows")
-        except Exception as e:
-            print(f"[WARN] {y}: {e}")
-        time.sleep(1.0)  # 降低风控概率
+    ap = argparse.ArgumentParser(description="Scrape Billboard Year-End Hot 100 lists from Wikipedia")
+    ap.add_argument("--start", type=int, default=1958)
+    ap.add_argument("--end", type=int, default=2024)
+    ap.add_argument("--out_csv", default="data_out/yearend_hot100_1958_2024.parquet", help=".parquet or .csv")
+    ap.add_argument("--cache_dir", default="data_out/_cache/wiki_yearend")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--host_rate", type=float, default=1.0, help="Max requests per second to Wikipedia")
+    args = ap.parse_args()
+
+    out_path = Path(args.out_csv)
+    # 逐年缓存：已定稿的年份不再请求；限速由 HostLimiter 负责（取代每年 sleep 1s）
+    by_year = fetch_years_cached(range(args.start, args.end + 1), wiki_url, parse_year, Path(args.cache_dir),
+                                 workers=args.workers, host_rate=args.host_rate, kind="wiki", headers=UA)
+    rows = list(by_year.values())
     if not rows:
         raise SystemExit("No tables parsed. Check network/parse deps (lxml/html5lib).")
     all_df = pd.concat(rows, ignore_index=True)
-    out_path = outdir / "yearend_hot100_1958_2024.csv"
-    all_df.to_csv(out_path, index=False)
+    write_table(all_df, out_path)
     chk = all_df.groupby("year")["rank"].count().reset_index(name="rows_per_year")
     print("Saved ->", out_path)
     print(chk.head(10).to_string(index=False))
@@ -6,11 +6,8 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
-try:
-    from nltk.stem import PorterStemmer
-    stemmer = PorterStemmer()
-except Exception:
-    stemmer = None
+from lyripop.tables import read_table
+from lyripop.textprep import Song, STEM_TOKEN_RE, stem_tokens
 
 def clean_text(raw: str) -> str:
     s = html.unescape(raw or "")
@@ -20,11 +17,8 @@ def clean_text(raw: str) -> str:
     return s
 
 def tokenize_stem(s: str):
-    # 简单英文 token（保留撇号），再 Porter stem
-    toks = re.findall(r"[a-z]+'?[a-z]*", s)
-    if stemmer:
-        toks = [stemmer.stem(t) for t in toks]
-    return toks
+    # 简单英文 token（保留撇号），再 Porter stem（每个词形只 stem 一次）
+    return stem_tokens(Song(s, token_re=STEM_TOKEN_RE).tokens)
 
 def track_stats(tokens):
     total = len(tokens)
@@ -61,21 +55,20 @@ def ols(tbl):
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--lyrics_csv", required=True)   # data_out/yearend_hot100_lyrics_1958_2024.csv
+    ap.add_argument("--lyrics_csv", required=True)   # data_out/yearend_hot100_lyrics_1958_2024.parquet（或 .csv）
     ap.add_argument("--out_prefix", default="data_out/top5_extra_1958_2024")
     ap.add_argument("--start", type=int, default=1958)
     ap.add_argument("--end",   type=int, default=2024)
     args = ap.parse_args()
 
-    df = pd.read_csv(args.lyrics_csv)
-    df = df[(df["rank"]<=5) & (df["year"].between(args.start, args.end))].copy()
+    # tracks CSV 带出歌词表的所有列，所以不做列投影；只按年份 / 名次过滤
+    df = read_table(args.lyrics_csv, years=(args.start, args.end), ranks=(1, 5))
     # 清洗 + 词干化
     stats_rows = []
-    for _, r in df.iterrows():
-        txt = clean_text(str(r.get("lyrics_raw","")))
-        toks = tokenize_stem(txt)
+    for r in df.to_dict("records"):
+        toks = tokenize_stem(clean_text(str(r.get("lyrics_raw",""))))
         st = track_stats(toks)
-        stats_rows.append({**r.to_dict(), **st})
+        stats_rows.append({**r, **st})
     out_tracks = f"{args.out_prefix}_tracks.csv"
     pd.DataFrame(stats_rows).to_csv(out_tracks, index=False)
 
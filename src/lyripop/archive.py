@@ -0,0 +1,70 @@
+import gzip, hashlib, sqlite3, threading, time
+from pathlib import Path
+
+def html_parser() -> str:
+    """Fastest BeautifulSoup backend available: lxml if installed, else the stdlib html.parser."""
+    try:
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html.parser"
+
+class HtmlArchive:
+    """Content-addressed, gzip-compressed store of raw fetched pages.
+
+    objects/<sha[:2]>/<sha>.html.gz holds each distinct page body once; index.sqlite maps
+    (kind, key) -> every sha seen for it, so the newest version can be re-parsed offline.
+    kind is "chart" (key = year) or "lyrics" (key = song_key).
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        # 抓取线程会并发写入：共享连接 + 锁
+        self.db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (kind TEXT, key TEXT, url TEXT, sha TEXT,"
+                        " fetched_at REAL, PRIMARY KEY (kind, key, sha))")
+
+    def _obj(self, sha: str) -> Path:
+        return self.root / "objects" / sha[:2] / f"{sha}.html.gz"
+
+    def put(self, kind: str, key: str, url: str, text: str, fetched_at: float = None) -> str:
+        raw = text.encode("utf-8")
+        sha = hashlib.sha256(raw).hexdigest()
+        fp = self._obj(sha)
+        if not fp.exists():
+            fp.parent.mkdir(exist_ok=True)
+            tmp = fp.with_suffix(f".tmp{threading.get_ident()}")
+            tmp.write_bytes(gzip.compress(raw, 6))
+            tmp.replace(fp)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?)",
+                            (kind, str(key), url, sha, time.time() if fetched_at is None else fetched_at))
+            self.db.commit()
+        return sha
+
+    def get(self, sha: str) -> str:
+        return read_object(self.root, sha)
+
+    def latest(self, kind: str) -> dict:
+        """{key: (url, sha)} of the newest archived page per key."""
+        with self.lock:
+            cur = self.db.execute("SELECT key, url, sha FROM pages WHERE kind=? ORDER BY fetched_at", (kind,))
+            return {k: (url, sha) for k, url, sha in cur}
+
+    def import_files(self, kind: str, files: dict) -> int:
+        """Archive existing HTML files, {key: path}; fetch time = file mtime. Idempotent."""
+        n = 0
+        for key, fp in files.items():
+            fp = Path(fp)
+            self.put(kind, key, fp.resolve().as_uri(), fp.read_text(encoding="utf-8", errors="replace"), fp.stat().st_mtime)
+            n += 1
+        return n
+
+    def close(self):
+        self.db.close()
+
+def read_object(root: Path, sha: str) -> str:
+    # 模块级函数：进程池里的 worker 只需要 root 就能读，不必 pickle 整个 archive
+    return gzip.decompress((Path(root) / "objects" / sha[:2] / f"{sha}.html.gz").read_bytes()).decode("utf-8")
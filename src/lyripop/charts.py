@@ -1,13 +1,22 @@
+import json, time, datetime
 import pandas as pd
-import requests, re
+import re
 from bs4 import BeautifulSoup
 import billboard
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from .archive import html_parser, read_object
+from .net import HostLimiter, conditional_headers, pooled_session
+from .parallel import fork_map
+
 HEADERS = {"User-Agent": "Mozilla/5.0"}
+YEAR_END_URL = "https://www.billboard.com/charts/year-end/{year}/hot-100-songs/"
 
-def fetch_year_end_hot100_billboardpy(year: int) -> pd.DataFrame:
-    chart = billboard.ChartData("hot-100-songs", year=str(year))
+def parse_year_end_billboardpy(year: int, html: str, features: str = "html.parser") -> pd.DataFrame:
+    # 复用 billboard.py 的解析逻辑，但页面由我们自己下载（可存档、可离线重解析）
+    chart = billboard.ChartData("hot-100-songs", year=str(year), fetch=False)
+    chart._parsePage(BeautifulSoup(html, features))
     rows = [{
         "year": year,
         "rank": int(e.rank),
@@ -19,13 +28,8 @@ def fetch_year_end_hot100_billboardpy(year: int) -> pd.DataFrame:
     } for e in chart]
     return pd.DataFrame(rows)
 
-def fetch_year_end_hot100_scrape(year: int, save_html: Path=None) -> pd.DataFrame:
-    url = f"https://www.billboard.com/charts/year-end/{year}/hot-100-songs/"
-    r = requests.get(url, headers=HEADERS, timeout=30)
-    r.raise_for_status()
-    html = r.text
-    if save_html: save_html.write_text(html, encoding="utf-8")
-    soup = BeautifulSoup(html, "html.parser")
+def parse_year_end_scrape(year: int, html: str, features: str = "html.parser") -> pd.DataFrame:
+    soup = BeautifulSoup(html, features)
     rows = []
     items = soup.select(".o-chart-results-list__item") or soup.select("ul.o-chart-results-list li")
     if not items:
@@ -47,15 +51,135 @@ def fetch_year_end_hot100_scrape(year: int, save_html: Path=None) -> pd.DataFram
     df = pd.DataFrame(rows).drop_duplicates(subset=["year","rank"]).sort_values("rank")
     return df
 
-def fetch_year_end_hot100(year: int, fallback_dir: Path=None) -> pd.DataFrame:
+def parse_year_end_hot100(year: int, html: str, features: str = "html.parser") -> pd.DataFrame:
+    """billboard.py's parser first; the generic scrape parser when it yields < 95 rows."""
+    try:
+        df = parse_year_end_billboardpy(year, html, features)
+        if len(df) >= 95:
+            return df
+    except Exception:
+        pass
+    return parse_year_end_scrape(year, html, features)
+
+def _download(year: int, archive=None) -> str:
+    url = YEAR_END_URL.format(year=year)
+    http = pooled_session(1)
+    try:
+        r = http.get(url, headers=HEADERS, timeout=30)
+    finally:
+        http.close()
+    r.raise_for_status()
+    if archive is not None:
+        archive.put("chart", str(year), url, r.text)
+    return r.text
+
+def fetch_year_end_hot100_billboardpy(year: int, archive=None) -> pd.DataFrame:
+    return parse_year_end_billboardpy(year, _download(year, archive))
+
+def fetch_year_end_hot100_scrape(year: int, save_html: Path=None, archive=None) -> pd.DataFrame:
+    html = _download(year, archive)
+    if save_html: save_html.write_text(html, encoding="utf-8")
+    return parse_year_end_scrape(year, html)
+
+def fetch_year_end_hot100(year: int, fallback_dir: Path=None, archive=None) -> pd.DataFrame:
+    # 只下载一次：billboard.py 解析与抓取解析共用同一页面（传入 archive 时存档）
+    html = _download(year, archive)
     try:
-        df = fetch_year_end_hot100_billboardpy(year)
+        df = parse_year_end_billboardpy(year, html)
         if len(df) >= 95:
             return df
     except Exception:
         pass
-    save_html = None
     if fallback_dir:
         fallback_dir.mkdir(parents=True, exist_ok=True)
-        save_html = fallback_dir / f"billboard_yearend_{year}.html"
-    return fetch_year_end_hot100_scrape(year, save_html=save_html)
+        (fallback_dir / f"billboard_yearend_{year}.html").write_text(html, encoding="utf-8")
+    return parse_year_end_scrape(year, html)
+
+def _year_is_final(year: int, fetched_at: float) -> bool:
+    # 年终榜在该年结束后才定稿；之后抓到的版本不会再变
+    return datetime.datetime.fromtimestamp(fetched_at, datetime.timezone.utc).year > year
+
+def fetch_years_cached(years, url_for, parse, cache_dir: Path, workers: int = 4, host_rate: float = 1.0,
+                       host_concurrency: int = 2, max_age: float = 86400, archive=None, kind: str = "chart",
+                       headers: dict = None) -> dict:
+    """{year: DataFrame} for chart pages, with a per-year cache in `cache_dir` (<year>.csv + <year>.json).
+
+    Cached years fetched after the year ended are final and never re-requested; others are
+    revalidated with a conditional GET (ETag / Last-Modified) once older than `max_age`
+    seconds. Years are fetched by `workers` threads, at most `host_concurrency` at a time and
+    `host_rate` requests/s per host. A year that fails keeps its cached rows, if any.
+    """
+    cache_dir = Path(cache_dir); cache_dir.mkdir(parents=True, exist_ok=True)
+    out = {}; todo = []
+    for y in years:
+        fp = cache_dir / f"{y}.json"
+        meta = json.loads(fp.read_text(encoding="utf-8")) if fp.exists() and (cache_dir / f"{y}.csv").exists() else {}
+        if meta:
+            if _year_is_final(y, meta["fetched_at"]) or time.time() - meta["fetched_at"] < max_age:
+                out[y] = _load_year(cache_dir, y)
+                continue
+        todo.append((y, meta))
+    if not todo:
+        return out
+    http = HostLimiter(rate=host_rate, concurrency=host_concurrency)
+
+    def work(y, meta):
+        url = url_for(y)
+        hdrs = {**(headers or HEADERS), **(conditional_headers(meta) if meta.get("url") == url else {})}
+        r = http.get(url, headers=hdrs, timeout=30)
+        now = time.time()
+        if r.status_code == 304:
+            meta["fetched_at"] = now
+            _save_year(cache_dir, y, None, meta)
+            return y, _load_year(cache_dir, y), "not modified"
+        r.raise_for_status()
+        if archive is not None:
+            archive.put(kind, str(y), url, r.text)
+        df = parse(y, r.text)
+        meta = {"url": url, "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified"),
+                "fetched_at": now, "rows": int(len(df))}
+        if len(df):
+            _save_year(cache_dir, y, df, meta)
+        return y, df, "fetched"
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            futs = [(y, meta, ex.submit(work, y, meta)) for y, meta in todo]
+            for y, meta, f in futs:
+                try:
+                    _, df, how = f.result()
+                    out[y] = df
+                    print(f"[OK] {y}: {len(df)} rows ({how})")
+                except Exception as e:
+                    print(f"[WARN] {y}: {e}")
+                    if meta:
+                        out[y] = _load_year(cache_dir, y)
+    finally:
+        http.close()
+    return {y: out[y] for y in years if y in out}
+
+def _load_year(cache_dir: Path, year: int) -> pd.DataFrame:
+    # 只把空串当缺失：歌名 "NA" / "None" 不能被读成 NaN
+    return pd.read_csv(cache_dir / f"{year}.csv", keep_default_na=False, na_values=[""])
+
+def _save_year(cache_dir: Path, year: int, df, meta: dict):
+    if df is not None:
+        df.to_csv(cache_dir / f"{year}.csv", index=False)
+    (cache_dir / f"{year}.json").write_text(json.dumps(meta), encoding="utf-8")
+
+def fetch_year_end_hot100_years(years, cache_dir: Path, workers: int = 4, archive=None, **kw) -> dict:
+    """{year: Billboard Year-End Hot 100} for all `years`, via fetch_years_cached()."""
+    return fetch_years_cached(years, lambda y: YEAR_END_URL.format(year=y), parse_year_end_hot100, cache_dir,
+                              workers=workers, archive=archive, **kw)
+
+def _parse_archived_charts(root, items):
+    features = html_parser()
+    return [parse_year_end_hot100(int(y), read_object(root, sha), features) for y, sha in items]
+
+def reparse_year_end_hot100(archive, years, workers: int = 1) -> dict:
+    """{year: chart} re-parsed from the newest archived page of each year, in a process pool
+    (no network). Years without an archived page are left out."""
+    pages = archive.latest("chart")
+    items = [(y, pages[str(y)][1]) for y in years if str(y) in pages]
+    return dict(zip([y for y, _ in items], fork_map(_parse_archived_charts, items, shared=archive.root,
+                                                     workers=workers)))
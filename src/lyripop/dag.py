@@ -0,0 +1,164 @@
+import hashlib, json, os, subprocess, sys, time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from .store import source_stamp, stamp_matches
+
+class Stage:
+    """One step of the stage graph: a command plus the files it reads and writes.
+
+    cmd: argv list (its text is the parameter fingerprint); inputs / outputs: files or
+    directories; code: source files whose content versions the stage; trees: {directory:
+    depth} of large read-only trees stamped by their directory mtimes only (see tree_stamp).
+    A stage depends on the last earlier-declared stage that writes one of its inputs.
+    """
+
+    def __init__(self, name: str, cmd, inputs=(), outputs=(), code=(), trees=None):
+        self.name = name; self.cmd = [str(c) for c in cmd]
+        self.inputs = [Path(p) for p in inputs]; self.outputs = [Path(p) for p in outputs]
+        self.code = [Path(p) for p in code]
+        self.trees = {Path(p): int(d) for p, d in (trees or {}).items()}
+
+def path_stamp(path: Path):
+    """source_stamp for a file; for a directory, a hash of its (relative path, size, mtime) listing."""
+    path = Path(path)
+    if path.is_dir():
+        h = hashlib.sha1()
+        for fp in sorted(p for p in path.rglob("*") if p.is_file()):
+            st = fp.stat()
+            h.update(f"{fp.relative_to(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+        return {"dir": h.hexdigest()}
+    return source_stamp(path) if path.exists() else None
+
+def tree_stamp(path: Path, depth: int):
+    """Hash of the mtimes of `path` and its subdirectories down to `depth` levels.
+
+    Files are never listed or stat'ed, so only entries added, removed or renamed in those
+    directories register (the same revalidation BimmudaCatalogue uses for its listings).
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return None
+    h = hashlib.sha1(); level = [(path, ".")]
+    for d in range(depth + 1):
+        nxt = []
+        for p, rel in level:
+            h.update(f"{rel}\0{p.stat().st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+            if d < depth:
+                with os.scandir(p) as it:
+                    nxt += sorted((Path(e.path), f"{rel}/{e.name}") for e in it if e.is_dir())
+        level = nxt
+    return {"tree": h.hexdigest()}
+
+def stamp_ok(stamp, path: Path) -> bool:
+    path = Path(path)
+    if stamp is None or "dir" in stamp:
+        return stamp == path_stamp(path)
+    return stamp_matches(stamp, path)
+
+def load_state(path: Path) -> dict:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def save_state(path: Path, state: dict):
+    path = Path(path); path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(path)
+
+def is_fresh(stage: Stage, rec: dict) -> bool:
+    # 参数、代码、输入都与上次成功运行时一致，且输出都在：可以跳过。只比 size/mtime，mtime 变了才算 hash
+    if not rec or rec.get("cmd") != stage.cmd:
+        return False
+    if not all(p.exists() for p in stage.outputs):
+        return False
+    for kind, paths in (("code", stage.code), ("inputs", stage.inputs)):
+        recs = rec.get(kind, {})
+        if set(recs) != {str(p) for p in paths} or not all(stamp_ok(recs[str(p)], p) for p in paths):
+            return False
+    trees = rec.get("trees", {})
+    return set(trees) == {str(p) for p in stage.trees} and all(
+        trees[str(p)] == tree_stamp(p, d) for p, d in stage.trees.items())
+
+def refresh(rec: dict) -> bool:
+    """Bring recorded mtimes up to date after is_fresh matched a touched file by hash."""
+    changed = False
+    for kind in ("code", "inputs"):
+        for p, stamp in rec.get(kind, {}).items():
+            if stamp and "mtime_ns" in stamp and Path(p).stat().st_mtime_ns != stamp["mtime_ns"]:
+                stamp["mtime_ns"] = Path(p).stat().st_mtime_ns; changed = True
+    return changed
+
+def record(stage: Stage) -> dict:
+    # 运行之后再记录输入：原地改写输入的 stage（merge_manual_stubs）下次不会被自己的输出触发重跑
+    return {"cmd": stage.cmd, "code": {str(p): path_stamp(p) for p in stage.code},
+            "inputs": {str(p): path_stamp(p) for p in stage.inputs},
+            "trees": {str(p): tree_stamp(p, d) for p, d in stage.trees.items()}, "finished_at": round(time.time(), 3)}
+
+def dependencies(stages) -> dict:
+    deps = {}; writer = {}
+    for st in stages:
+        deps[st.name] = {writer[str(p)] for p in st.inputs if str(p) in writer}
+        for p in st.outputs:
+            writer[str(p)] = st.name
+    return deps
+
+def _run(stage: Stage, log_dir: Path, cwd: Path, env: dict) -> tuple:
+    log = Path(log_dir) / f"{stage.name}.log"; log.parent.mkdir(parents=True, exist_ok=True)
+    t = time.monotonic()
+    with log.open("w", encoding="utf-8") as f:
+        f.write("$ " + " ".join(stage.cmd) + "\n"); f.flush()
+        rc = subprocess.call(stage.cmd, cwd=str(cwd), env=env, stdout=f, stderr=subprocess.STDOUT)
+    return rc, time.monotonic() - t, log
+
+def run_stages(stages, state_path: Path, log_dir: Path, jobs: int = 2, force=(), dry_run: bool = False,
+               cwd: Path = None, env: dict = None) -> dict:
+    """Run stale stages in dependency order, up to `jobs` at a time; returns {name: status}.
+
+    status: "fresh" (skipped), "ran", "failed", "blocked" (a dependency failed) or "stale"
+    (dry run). A stage whose dependency ran is re-checked against the new input stamps, so it
+    only runs if that output actually changed.
+    """
+    stages = list(stages); by_name = {st.name: st for st in stages}
+    deps = dependencies(stages); state = load_state(state_path)
+    cwd = Path(cwd or "."); env = dict(os.environ if env is None else env)
+    force = set(by_name) if "all" in force else set(force)
+    status = {}; running = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        while len(status) < len(stages):
+            for st in stages:
+                if st.name in status or st.name in running.values():
+                    continue
+                ds = [status.get(d) for d in deps[st.name]]
+                if any(s in ("failed", "blocked") for s in ds):
+                    status[st.name] = "blocked"; print(f"[SKIP] {st.name}: blocked by a failed dependency")
+                    continue
+                if any(s is None for s in ds):
+                    continue
+                if st.name not in force and "stale" not in ds and is_fresh(st, state.get(st.name)):
+                    status[st.name] = "fresh"; print(f"[OK] {st.name}: up to date")
+                    if not dry_run and refresh(state[st.name]):
+                        save_state(state_path, state)
+                    continue
+                if dry_run:
+                    status[st.name] = "stale"; print(f"[STALE] {st.name}: {' '.join(st.cmd)}")
+                    continue
+                print(f"[RUN] {st.name}")
+                running[ex.submit(_run, st, log_dir, cwd, env)] = st.name
+            if not running:
+                continue
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut); rc, dt, log = fut.result()
+                if rc == 0:
+                    status[name] = "ran"
+                    state[name] = record(by_name[name]); save_state(state_path, state)
+                    print(f"[OK] {name}: done in {dt:.1f}s (log: {log})")
+                else:
+                    status[name] = "failed"
+                    tail = log.read_text(encoding="utf-8", errors="replace").splitlines()[-10:]
+                    print(f"[ERROR] {name}: exit {rc} after {dt:.1f}s (log: {log})\n    " + "\n    ".join(tail),
+                          file=sys.stderr)
+    return status
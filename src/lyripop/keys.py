@@ -0,0 +1,94 @@
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# 所有匹配脚本共用的标题 / 艺人归一化。标量函数带 LRU 缓存；*_series 每个不同取值只算一次再广播回去
+FEAT_RE = re.compile(r"feat\.|featuring|with")
+PAREN_RE = re.compile(r"\([^)]*\)")
+NON_KEY_RE = re.compile(r"[^a-z0-9\s']")  # 引号也在这里被去掉
+SPACE_RE = re.compile(r"\s+")
+ARTIST_SPLIT_RE = re.compile(r"feat\.|featuring|with|&|,|\(|\)", re.I)
+VERSION_RE = re.compile(r"\([^)]*version[^)]*\)", re.I)
+REMIX_RE = re.compile(r"\([^)]*remix[^)]*\)", re.I)
+DASH_TAIL_RE = re.compile(r"\s+-\s+.*$")
+KEY_CACHE_SIZE = 1 << 20  # MXM 779k 行的标题 + 艺人去重后也放得下
+
+ARTIST_ALIAS = {
+    "ross bagdasarian": "david seville",
+    "the weeknd": "weeknd",
+    "p!nk": "pink",
+    "ac dc": "acdc",
+    "marky mark and the funky bunch": "marky mark funky bunch",
+    "prince and the revolution": "prince",
+    "puff daddy": "diddy",
+    "jay z": "jayz",
+}
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def norm_mxm(s) -> str:
+    """MXM matching key: lowercase, '&' -> 'and', feat./featuring/with and non [a-z0-9'] to spaces."""
+    s = (s or "").lower().replace("&", " and ")
+    s = FEAT_RE.sub(" ", s)
+    s = NON_KEY_RE.sub(" ", s)
+    return SPACE_RE.sub(" ", s).strip()
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def norm_text(s) -> str:
+    """Like norm_mxm, but parenthesised parts are dropped as well (BiMMuDa, manual stubs)."""
+    s = (s or "").lower().replace("&", " and ")
+    s = FEAT_RE.sub(" ", s)
+    s = PAREN_RE.sub(" ", s)
+    s = NON_KEY_RE.sub(" ", s)
+    return SPACE_RE.sub(" ", s).strip()
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def canon_artist(s) -> str:
+    s2 = norm_text(s)
+    return ARTIST_ALIAS.get(s2, s2)
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def normalise_artist(artist: str) -> str:
+    """Lead artist only (cut at feat./featuring/with/&/,/parentheses), for lyric searches."""
+    return ARTIST_SPLIT_RE.split(artist or "", maxsplit=1)[0].strip()
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def normalise_title(title: str) -> str:
+    """Title without "(... version)" / "(... remix)" and " - ..." suffixes, for lyric searches."""
+    t = VERSION_RE.sub("", title or "")
+    t = REMIX_RE.sub("", t)
+    t = DASH_TAIL_RE.sub("", t)
+    return t.strip()
+
+def mxm_key(title, artist) -> str:
+    return f"{norm_mxm(title)} {norm_mxm(artist)}".strip()
+
+def text_key(title, artist) -> str:
+    return f"{norm_text(title)} {norm_text(artist)}".strip()
+
+def combo_key(title, artist) -> str:
+    return f"{norm_text(title)} {canon_artist(artist)}".strip()
+
+def key_series(values, fn) -> pd.Series:
+    """fn over a Series / list, called once per distinct value (NaN counts as "")."""
+    s = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Parquet 读出的 title/artist 已是分类列：直接用类别；缺失值的 code 是 -1，正好落到末尾的 ""
+        codes, uniq = s.cat.codes.to_numpy(), list(s.cat.categories) + [""]
+    else:
+        codes, uniq = pd.factorize(s.fillna(""))
+    keys = np.array([fn(v) for v in uniq], dtype=object)
+    return pd.Series(keys[codes], index=s.index, dtype=object)
+
+def _pair_series(titles, artists, title_fn, artist_fn) -> pd.Series:
+    t = key_series(titles, title_fn); a = key_series(artists, artist_fn)
+    return (t + " " + a.to_numpy()).str.strip()
+
+def mxm_key_series(titles, artists) -> pd.Series:
+    return _pair_series(titles, artists, norm_mxm, norm_mxm)
+
+def text_key_series(titles, artists) -> pd.Series:
+    return _pair_series(titles, artists, norm_text, norm_text)
+
+def combo_key_series(titles, artists) -> pd.Series:
+    return _pair_series(titles, artists, norm_text, canon_artist)
@@ -1,4 +1,6 @@
-import os, time, json, random
+import os, time, random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 from typing import Tuple, List, Dict
 
@@ -9,7 +11,11 @@ from dotenv import load_dotenv
 from rapidfuzz import fuzz
 from tqdm import tqdm
 
-from .utils import safe_filename, normalise_artist, normalise_title
+from .net import TokenBucket, ThrottledSession, FetchJournal, TransientHTTPError, get_with_retry, pooled_session
+from .archive import html_parser, read_object
+from .lyrics_cache import LyricsCache, song_key
+from .parallel import fork_map
+from .keys import normalise_artist, normalise_title
 
 UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
 HDRS = {
@@ -21,8 +27,13 @@ HDRS = {
     "Connection": "keep-alive",
 }
 
+def _api_base() -> str:
+    # 可用环境变量指向本地的替身服务器（测试用）
+    return os.getenv("GENIUS_API_BASE", "https://api.genius.com").rstrip("/")
+
+@lru_cache(maxsize=1)
 def _get_token() -> str:
-    # 显式从工程根目录加载 .env
+    # 显式从工程根目录加载 .env（只在第一次调用时读取）
     project_root = Path(__file__).resolve().parents[2]
     load_dotenv(dotenv_path=project_root / ".env")
     tok = os.getenv("GENIUS_ACCESS_TOKEN", "").strip()
@@ -30,31 +41,24 @@ def _get_token() -> str:
         raise RuntimeError("Missing GENIUS_ACCESS_TOKEN (check .env or export it in shell)")
     return tok
 
-def _official_api_search(token: str, query: str, per_page: int = 5) -> List[Dict]:
+def _official_api_search(token: str, query: str, per_page: int = 5, http=None, journal=None, tag=None,
+                         retries: int = 0, backoff: float = 1.0) -> List[Dict]:
     # 用官方 API（需要 Bearer token），避免被 public/multi 403
-    url = "https://api.genius.com/search"
+    url = f"{_api_base()}/search"
     params = {"q": query, "per_page": per_page}
     headers = {"Authorization": f"Bearer {token}", "User-Agent": UA}
-    r = requests.get(url, params=params, headers=headers, timeout=25)
+    r = get_with_retry(http or requests, url, journal, {**(tag or {}), "stage": "search"}, retries, backoff,
+                       params=params, headers=headers, timeout=25)
     if r.status_code == 401:
         raise RuntimeError("Genius API 401 Unauthorized: check your token.")
-    if r.status_code == 403:
-        raise RuntimeError("Genius API 403 Forbidden: access blocked by Genius. Try later or different network.")
     r.raise_for_status()
     data = r.json()
     hits = data.get("response", {}).get("hits", [])
     return hits
 
-def _scrape_lyrics_from_url(url: str) -> str:
-    if not url:
-        return ""
+def parse_lyrics_html(html: str, features: str = "html.parser") -> str:
     # 解析歌词页面里的 data-lyrics-container 区块
-    r = requests.get(url, headers=HDRS, timeout=25)
-    if r.status_code == 403:
-        return ""
-    if r.status_code >= 400:
-        return ""
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = BeautifulSoup(html, features)
     blocks = soup.select('div[data-lyrics-container="true"]')
     if not blocks:
         blk = soup.find("div", class_="Lyrics__Root")
@@ -69,54 +73,180 @@ def _scrape_lyrics_from_url(url: str) -> str:
     lyr = "\n".join(lines).strip()
     return lyr
 
-def fetch_lyric_for_row(_unused, title: str, artist: str) -> Tuple[str, str]:
-    # 用 官方API 搜索 → 选最佳候选 → 抓取歌词 HTML
-    token = _get_token()
-    q_title = normalise_title(title)
-    q_artist = normalise_artist(artist)
-    query = f"{q_title} {q_artist}".strip()
+def _scrape_lyrics_from_url(url: str, http=None, journal=None, tag=None, retries: int = 0,
+                            backoff: float = 1.0, archive=None) -> str:
+    if not url:
+        return ""
+    # 403/5xx 由 get_with_retry 重试，其余 4xx 视为没有歌词
+    r = get_with_retry(http or requests, url, journal, {**(tag or {}), "stage": "page"}, retries, backoff,
+                       headers=HDRS, timeout=25)
+    if r.status_code >= 400:
+        return ""
+    if archive is not None:
+        archive.put("lyrics", (tag or {}).get("key", url), url, r.text)
+    return parse_lyrics_html(r.text)
+
+def _fetch_song(title: str, artist: str, http=None, token: str = None, journal=None, key: str = "",
+                retries: int = 0, backoff: float = 1.0, hit_url: str = None, archive=None) -> Tuple[str, str, str]:
+    """(status, lyrics, url) with status "ok" / "not_found"; raises TransientHTTPError.
+
+    `hit_url` is a lyric page URL resolved by an earlier (interrupted) run: the search is skipped.
+    """
+    token = token or _get_token()
+    tag = {"key": key}
+    if hit_url is None:
+        q_title = normalise_title(title)
+        q_artist = normalise_artist(artist)
+        query = f"{q_title} {q_artist}".strip()
+        hits = _official_api_search(token, query, per_page=5, http=http, journal=journal, tag=tag,
+                                    retries=retries, backoff=backoff)
+        best = None; best_sc = -1
+        for h in hits:
+            res = h.get("result", {})
+            cand = f"{res.get('title','')} {res.get('primary_artist',{}).get('name','')}"
+            sc = fuzz.token_set_ratio(query, cand)
+            if sc > best_sc:
+                best_sc, best = sc, res
+        hit_url = (best or {}).get("url", "") or ""
+        if journal and best:
+            journal.log(**tag, stage="hit", hit_url=hit_url)
+        if not best:
+            return "not_found", "", ""
+    lyr = _scrape_lyrics_from_url(hit_url, http=http, journal=journal, tag=tag, retries=retries, backoff=backoff,
+                                  archive=archive)
+    return ("ok" if lyr else "not_found"), (lyr or ""), hit_url
 
+def fetch_lyric_for_row(_unused, title: str, artist: str, http=None, token: str = None) -> Tuple[str, str]:
+    # 用 官方API 搜索 → 选最佳候选 → 抓取歌词 HTML（单条、不重试；失败返回空）
+    own = http is None
+    http = http or pooled_session(1)
     try:
-        hits = _official_api_search(token, query, per_page=5)
-    except Exception:
+        _, lyr, url = _fetch_song(title, artist, http=http, token=token)
+    except (RuntimeError, TransientHTTPError, requests.RequestException):
         return "", ""
+    finally:
+        if own:
+            http.close()
+    if own:
+        time.sleep(0.3 + random.random()*0.4)  # 轻微延时，降低被拦截概率
+    return lyr, url
 
-    best = None; best_sc = -1
-    for h in hits:
-        res = h.get("result", {})
-        cand = f"{res.get('title','')} {res.get('primary_artist',{}).get('name','')}"
-        sc = fuzz.token_set_ratio(query, cand)
-        if sc > best_sc:
-            best_sc, best = sc, res
+def _pending_hits(records) -> Dict[str, dict]:
+    # 搜索命中之后没有终态（ok / not_found）的歌曲才是被中断的工作；已有结论的命中不再复用
+    pending = {}
+    for rec in records:
+        if rec.get("stage") == "hit":
+            pending[rec.get("key")] = rec
+        elif rec.get("stage") == "song" and rec.get("outcome") in ("ok", "not_found"):
+            pending.pop(rec.get("key"), None)
+    return pending
 
-    if not best:
-        return "", ""
+def fetch_lyrics_for_chart(df: pd.DataFrame, cache_path: Path, workers: int = 4, rate: float = 3.0,
+                           legacy_dir: Path = None, journal_path: Path = None, retries: int = 3,
+                           backoff: float = 1.0, negative_ttl: float = 30 * 86400, archive=None,
+                           offline: bool = False) -> pd.DataFrame:
+    """Lyrics for every chart row, cached per song in the LyricsCache at `cache_path`.
 
-    url = best.get("url", "")
-    lyr = _scrape_lyrics_from_url(url)
-    time.sleep(0.3 + random.random()*0.4)  # 轻微延时，降低被拦截概率
-    return (lyr or ""), (url or "")
+    A legacy per-row JSON `legacy_dir` is imported into the cache on first use. Cache misses
+    are fetched by `workers` threads over one pooled session; all HTTP requests (search +
+    lyric page) share a token bucket of `rate` requests/s. Transient failures (network errors,
+    403/429/5xx) are retried `retries` times with exponential backoff and otherwise left
+    uncached for the next run; genuine not-founds are cached for `negative_ttl` seconds.
+    Every attempt is appended to the FetchJournal at `journal_path`; search hits of songs with
+    no outcome yet (an interrupted run) let a restart skip those searches. A completed run
+    rotates the journal down to those pending hits. Ctrl-C or a fatal error (e.g. a 401
+    for a bad token) cancels the queued songs and saves the in-flight ones before re-raising.
+    Raw lyric pages go to the HtmlArchive `archive` (see reparse_lyrics). With `offline`
+    nothing is fetched and cache misses come back empty. Output is in row order.
+    """
+    cache = LyricsCache(cache_path)
+    if legacy_dir is not None and (n := cache.migrate_json_dir(legacy_dir)):
+        print(f"[INFO] Imported {n} songs from {legacy_dir} -> {cache_path}")
+    rows = df.to_dict("records")
+    keys = [song_key(r["title"], r["artist"]) for r in rows]
+    known = cache.get_many(keys, negative_ttl=negative_ttl)
+    todo = {}
+    for r, k in zip(rows, keys):
+        if k not in known and not offline:
+            todo.setdefault(k, r)
+    journal = FetchJournal(journal_path) if journal_path else None
+    failed = []
+    try:
+        if todo:
+            token = _get_token()
+            hits = {}
+            if journal:
+                hits = {k: rec["hit_url"] for k, rec in _pending_hits(journal.records()).items() if k in todo}
+                if hits:
+                    print(f"[INFO] Resuming {len(hits)} songs from {journal_path} (search already done)")
+            http = ThrottledSession(bucket=TokenBucket(rate, burst=workers), pool_size=workers)
 
-def fetch_lyrics_for_chart(df: pd.DataFrame, cache_dir: Path) -> pd.DataFrame:
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    out = []
-    for _, r in tqdm(
-        df.iterrows(), total=len(df),
-        desc=f"Fetching lyrics {int(df['year'].min())}-{int(df['year'].max())}"
-    ):
-        title, artist = r["title"], r["artist"]
-        cache_name = safe_filename(f"{r['year']}_{r['rank']}_{title}_{artist}.json")
-        cache_path = cache_dir / cache_name
-        if cache_path.exists():
+            def save(k, f):
+                try:
+                    status, raw, url = f.result()
+                except (TransientHTTPError, requests.RequestException) as e:
+                    failed.append(k)
+                    if journal:
+                        journal.log(key=k, stage="song", outcome="failed", error=str(e))
+                    return
+                # 每首歌取回后立即落盘：中途中断也不丢已完成的部分
+                cache.put_many([(k, todo[k]["title"], todo[k]["artist"], raw, url)], status=status)
+                known[k] = (raw, url)
+                if journal:
+                    journal.log(key=k, stage="song", outcome=status)
+
+            ex = ThreadPoolExecutor(max_workers=max(1, workers))
+            futs = {ex.submit(_fetch_song, r["title"], r["artist"], http=http, token=token, journal=journal,
+                              key=k, retries=retries, backoff=backoff, hit_url=hits.get(k), archive=archive): k
+                    for k, r in todo.items()}
+            done = set()
             try:
-                data = json.loads(cache_path.read_text(encoding="utf-8"))
-                raw, url = data.get("lyrics",""), data.get("url","")
-            except Exception:
-                raw, url = "", ""
-        else:
-            raw, url = fetch_lyric_for_row(None, title, artist)
-            data = {"year": int(r["year"]), "rank": int(r["rank"]), "title": title, "artist": artist,
-                    "lyrics": raw, "url": url}
-            cache_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
-        out.append({**r.to_dict(), "lyrics_raw": raw, "lyrics_url": url})
+                for f in tqdm(as_completed(futs), total=len(futs),
+                              desc=f"Fetching lyrics {int(df['year'].min())}-{int(df['year'].max())}"):
+                    done.add(f); save(futs[f], f)
+            except BaseException as e:
+                # Ctrl-C 或致命错误（如 401 token 失效）：取消排队的任务，等在途请求结束并落盘，然后退出；
+                # 重跑时从缓存/日志继续
+                if isinstance(e, KeyboardInterrupt):
+                    print("\n[WARN] Interrupted: saving in-flight results ...")
+                ex.shutdown(wait=True, cancel_futures=True)
+                for f in futs:
+                    if f not in done and f.done() and not f.cancelled() and (
+                            f.exception() is None
+                            or isinstance(f.exception(), (TransientHTTPError, requests.RequestException))):
+                        save(futs[f], f)
+                raise
+            finally:
+                ex.shutdown(wait=True)
+                http.close()
+        cache.add_charts((r["year"], r["rank"], k) for r, k in zip(rows, keys))
+        if journal:
+            # 跑完后只留下仍未完成的命中，日志不再无限增长；完整记录保留在 <name>.1
+            journal.compact(lambda recs: _pending_hits(recs).values())
+    finally:
+        cache.close()
+        if journal:
+            journal.close()
+    if failed:
+        print(f"[WARN] {len(failed)} songs failed after {retries} retries (left uncached; rerun to retry).")
+    out = []
+    for r, k in zip(rows, keys):
+        raw, url = known.get(k, ("", ""))
+        out.append({**r, "lyrics_raw": raw, "lyrics_url": url})
     return pd.DataFrame(out)
+
+def _parse_archived_lyrics(root, items):
+    features = html_parser()
+    return [(k, parse_lyrics_html(read_object(root, sha), features), url) for k, url, sha in items]
+
+def reparse_lyrics(archive, cache_path: Path, workers: int = 1) -> int:
+    """Rebuild cached lyrics from the newest archived page of each song, in a process pool
+    (no network). Returns the number of pages parsed."""
+    items = [(k, url, sha) for k, (url, sha) in archive.latest("lyrics").items()]
+    parsed = fork_map(_parse_archived_lyrics, items, shared=archive.root, workers=workers)
+    cache = LyricsCache(cache_path)
+    try:
+        cache.set_lyrics(parsed)
+    finally:
+        cache.close()
+    return len(parsed)
@@ -0,0 +1,99 @@
+import json, sqlite3, time
+from pathlib import Path
+
+from .keys import normalise_artist, normalise_title
+from .utils import slugify
+
+def song_key(title: str, artist: str) -> str:
+    # 歌曲身份只看 (title, artist)：同一首歌跨年上榜、或年份标错，都命中同一条缓存
+    return f"{slugify(normalise_title(title))}|{slugify(normalise_artist(artist))}"
+
+class LyricsCache:
+    """Single-file SQLite lyrics cache keyed by song_key(title, artist).
+
+    songs: one row per song (lyrics, url, status, fetch time); charts: every (year, rank) the
+    song was seen at, kept as metadata only. status is "ok" or "not_found"; not-found entries
+    are a negative cache that expires after a TTL.
+    """
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = Path(path)
+        self.db = sqlite3.connect(str(path))
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS songs (key TEXT PRIMARY KEY, title TEXT, artist TEXT,"
+            " lyrics TEXT, url TEXT, fetched_at REAL, status TEXT);"
+            "CREATE TABLE IF NOT EXISTS charts (year INTEGER, rank INTEGER, key TEXT, PRIMARY KEY (year, rank, key));"
+            "CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);")
+        if "status" not in [c[1] for c in self.db.execute("PRAGMA table_info(songs)")]:
+            # 旧库：空歌词多半是当年搜索失败被缓存成空串，标成已过期的 not_found 以便重试
+            self.db.executescript(
+                "ALTER TABLE songs ADD COLUMN status TEXT;"
+                "UPDATE songs SET status = CASE WHEN lyrics <> '' THEN 'ok' ELSE 'not_found' END;"
+                "UPDATE songs SET fetched_at = 0 WHERE status = 'not_found';")
+
+    def get_many(self, keys, negative_ttl: float = None) -> dict:
+        """{key: (lyrics, url)} for cached keys; not-found entries older than `negative_ttl`
+        seconds count as missing (None: they never expire)."""
+        keys = list(dict.fromkeys(keys)); out = {}
+        since = time.time() - negative_ttl if negative_ttl is not None else float("-inf")
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            cur = self.db.execute(f"SELECT key, lyrics, url FROM songs WHERE key IN ({','.join('?' * len(part))})"
+                                  f" AND (status = 'ok' OR fetched_at >= ?)", [*part, since])
+            out.update({k: (lyr or "", url or "") for k, lyr, url in cur})
+        return out
+
+    def put_many(self, items, status: str = "ok", fetched_at: float = None):
+        """items: iterable of (key, title, artist, lyrics, url)."""
+        now = time.time() if fetched_at is None else fetched_at
+        self.db.executemany("INSERT OR REPLACE INTO songs (key, title, artist, lyrics, url, fetched_at, status)"
+                            " VALUES (?,?,?,?,?,?,?)",
+                            [(k, t, a, lyr, url, now, status) for k, t, a, lyr, url in items])
+        self.db.commit()
+
+    def set_lyrics(self, items):
+        """Overwrite lyrics/url of existing songs (re-parse); items: iterable of (key, lyrics, url)."""
+        now = time.time()
+        self.db.executemany("INSERT INTO songs (key, title, artist, lyrics, url, fetched_at, status)"
+                            " VALUES (?,'','',?,?,?,?) ON CONFLICT(key) DO UPDATE SET lyrics=excluded.lyrics,"
+                            " url=excluded.url, status=excluded.status",
+                            [(k, lyr, url, now, "ok" if lyr else "not_found") for k, lyr, url in items])
+        self.db.commit()
+
+    def add_charts(self, items):
+        """items: iterable of (year, rank, key)."""
+        self.db.executemany("INSERT OR IGNORE INTO charts VALUES (?,?,?)",
+                            [(int(y), int(r), k) for y, r, k in items])
+        self.db.commit()
+
+    def migrate_json_dir(self, cache_dir: Path) -> int:
+        """Import a legacy lyrics_cache/ of per-row JSON files once; returns songs imported."""
+        cache_dir = Path(cache_dir)
+        tag = f"migrated:{cache_dir.resolve()}"
+        if not cache_dir.is_dir() or self.db.execute("SELECT 1 FROM meta WHERE k=?", (tag,)).fetchone():
+            return 0
+        songs = {}; charts = []
+        for fp in sorted(cache_dir.glob("*.json")):
+            try:
+                d = json.loads(fp.read_text(encoding="utf-8"))
+            except Exception:
+                continue
+            k = song_key(d.get("title", ""), d.get("artist", ""))
+            # 同一首歌有多份时，保留有歌词的那份
+            if k not in songs or (d.get("lyrics") and not songs[k][3]):
+                songs[k] = (k, d.get("title", ""), d.get("artist", ""), d.get("lyrics", "") or "", d.get("url", "") or "")
+            if str(d.get("year", "")).isdigit() and str(d.get("rank", "")).isdigit():
+                charts.append((d["year"], d["rank"], k))
+        known = self.get_many(songs)
+        new = [v for k, v in songs.items() if k not in known or (v[3] and not known[k][0])]
+        self.put_many([v for v in new if v[3]])
+        # 旧缓存里的空歌词分不清是真没有还是请求失败：记为已过期的 not_found，下次抓取时重试
+        self.put_many([v for v in new if not v[3]], status="not_found", fetched_at=0)
+        self.add_charts(charts)
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?,?)", (tag, str(len(songs))))
+        self.db.commit()
+        return len(songs)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,210 @@
+import json, sqlite3
+from pathlib import Path
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from .parallel import fork_map
+from .store import fresh_meta, save_arrays, load_arrays, save_strings, load_strings
+
+MAX_TOKEN_LEN = 24      # 过长的 token 基本是噪声，不进索引
+POSTING_BUDGET = 200_000  # 每个 query 最多展开的倒排条目数（先用稀有词）
+EXPAND_MIN_LEN = 4      # 不在词表里的 query token，长度够才做模糊扩展
+EXPAND_CUTOFF = 80
+INDEX_VERSION = 1
+TABLE_COLS = ("msd_id", "mxm_tid", "artist_mxm", "title_mxm", "artist_key", "title_key", "mkey")
+INDEX_ARRAYS = ("vocab", "post_ptr", "post_rows")
+
+def key_tokens(key: str) -> list:
+    return [t for t in dict.fromkeys((key or "").split()) if len(t) <= MAX_TOKEN_LEN]
+
+class MatchIndex:
+    """Token inverted index over normalised 'title artist' keys plus batched rapidfuzz scoring.
+
+    vocab is sorted; rows containing vocab[t] are post_rows[post_ptr[t]:post_ptr[t+1]].
+    """
+
+    def __init__(self, keys, vocab, post_ptr, post_rows):
+        self.keys = keys
+        self.vocab = vocab
+        self.post_ptr = post_ptr
+        self.post_rows = post_rows
+        self._vocab_list = None
+
+    @classmethod
+    def build(cls, keys):
+        keys = np.asarray(keys, dtype=object)
+        tok_id = {}; toks = []; rows = []
+        for i, k in enumerate(keys.tolist()):
+            for t in key_tokens(k):
+                toks.append(tok_id.setdefault(t, len(tok_id))); rows.append(i)
+        vocab = np.array(list(tok_id), dtype=str) if tok_id else np.zeros(0, dtype="U1")
+        order = np.argsort(vocab, kind="stable")
+        rank = np.empty_like(order); rank[order] = np.arange(len(order))
+        toks = rank[np.asarray(toks, dtype=np.int64)] if toks else np.zeros(0, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        srt = np.lexsort((rows, toks))
+        post_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(toks, minlength=len(vocab)), out=post_ptr[1:])
+        return cls(keys, vocab[order], post_ptr, rows[srt].astype(np.int32))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _token_ids(self, tokens):
+        if not len(self.vocab) or not tokens:
+            return []
+        q = np.array(tokens, dtype=str)
+        pos = np.searchsorted(self.vocab, q)
+        pos = np.minimum(pos, len(self.vocab) - 1)
+        ids = []
+        for t, p, hit in zip(tokens, pos.tolist(), (self.vocab[pos] == q).tolist()):
+            if hit:
+                ids.append(p)
+            elif len(t) >= EXPAND_MIN_LEN:
+                # 拼写差异：在词表上做一次批量模糊查找，把近似词也当作 query token
+                if self._vocab_list is None:
+                    self._vocab_list = self.vocab.tolist()
+                for _, _, j in process.extract(t, self._vocab_list, scorer=fuzz.ratio,
+                                               limit=3, score_cutoff=EXPAND_CUTOFF):
+                    ids.append(j)
+        return list(dict.fromkeys(ids))
+
+    def candidates(self, query: str, limit: int = 3000) -> np.ndarray:
+        """Row ids sharing tokens with the query, ranked by summed idf, at most `limit`, ascending."""
+        ids = self._token_ids(key_tokens(query))
+        if not ids:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        df = self.post_ptr[ids + 1] - self.post_ptr[ids]
+        ids, df = ids[np.argsort(df, kind="stable")], np.sort(df, kind="stable")
+        # 从最稀有的词开始展开，超出预算的高频词（the/love/you…）不再展开
+        keep = max(1, int(np.searchsorted(np.cumsum(df), POSTING_BUDGET, side="right")))
+        ids, df = ids[:keep], df[:keep]
+        idf = np.log(len(self.keys) / np.maximum(df, 1)) + 1.0
+        rows = np.concatenate([self.post_rows[self.post_ptr[t]:self.post_ptr[t + 1]] for t in ids.tolist()])
+        uniq, inv = np.unique(rows, return_inverse=True)
+        if len(uniq) > limit:
+            sc = np.bincount(inv, weights=np.repeat(idf, df))
+            uniq = np.sort(uniq[np.argsort(-sc, kind="stable")[:limit]])
+        return uniq.astype(np.int64)
+
+    def topk(self, queries, k: int = 5, limit: int = 3000, score_cutoff: float = 0, scorer=fuzz.token_set_ratio):
+        """Best k candidate rows and scores per query; rows are -1 / scores NaN where fewer exist."""
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), np.nan, dtype=np.float64)
+        for qi, q in enumerate(queries):
+            cand = self.candidates(q, limit=limit)
+            if not len(cand):
+                continue
+            res = process.extract(q, self.keys[cand].tolist(), scorer=scorer,
+                                  limit=k, score_cutoff=score_cutoff)
+            for j, (_, sc, ci) in enumerate(res):
+                rows[qi, j] = cand[ci]; scores[qi, j] = sc
+        return rows, scores
+
+def best_matches(rows, scores, threshold: float):
+    """Row of the best candidate per query, -1 where it scores below `threshold`."""
+    best = rows[:, 0].copy()
+    best[~(scores[:, 0] >= threshold)] = -1
+    return best
+
+class MatchCache:
+    """SQLite store of per-query top-k results keyed by (index version, qkey, candidate limit).
+
+    Scores are stored without a cutoff, so any --threshold can be re-applied to them.
+    """
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS topk (version TEXT, lim INTEGER, qkey TEXT, k INTEGER,"
+                        " rows TEXT, scores TEXT, PRIMARY KEY (version, lim, qkey))")
+
+    def get_many(self, version: str, limit: int, k: int, qkeys) -> dict:
+        qkeys = list(qkeys); out = {}
+        for i in range(0, len(qkeys), 500):
+            part = qkeys[i:i + 500]
+            cur = self.db.execute(f"SELECT qkey, k, rows, scores FROM topk WHERE version=? AND lim=?"
+                                  f" AND qkey IN ({','.join('?' * len(part))})", [version, limit, *part])
+            for q, kk, rows, scores in cur:
+                rows, scores = json.loads(rows), json.loads(scores)
+                # 缓存里的 k 不够时（且当时确有更多候选）视为未命中
+                if kk >= k or len(rows) < kk:
+                    out[q] = (rows[:k], scores[:k])
+        return out
+
+    def put_many(self, version: str, limit: int, k: int, items: dict):
+        self.db.executemany("INSERT OR REPLACE INTO topk VALUES (?,?,?,?,?,?)",
+                            [(version, limit, q, k, json.dumps(r), json.dumps(s)) for q, (r, s) in items.items()])
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def _topk_chunk(shared, queries):
+    index, k, limit = shared
+    rows, scores = index.topk(queries, k=k, limit=limit)
+    return list(zip(rows.tolist(), scores.tolist()))
+
+def cached_topk(index: MatchIndex, queries, k: int = 5, limit: int = 3000, cache: MatchCache = None,
+                version: str = "", workers: int = 1):
+    """MatchIndex.topk() that scores each distinct query once and reuses/persists results via `cache`.
+
+    Unseen queries are split across `workers` forked processes that share the index.
+    """
+    queries = list(queries)
+    uniq = list(dict.fromkeys(queries))
+    known = cache.get_many(version, limit, k, uniq) if cache else {}
+    todo = [q for q in uniq if q not in known]
+    if todo:
+        fresh = {}
+        for q, (r, sc) in zip(todo, fork_map(_topk_chunk, todo, shared=(index, k, limit), workers=workers)):
+            n = sum(1 for x in r if x >= 0)
+            fresh[q] = (r[:n], sc[:n])
+        if cache:
+            cache.put_many(version, limit, k, fresh)
+        known.update(fresh)
+    print(f"[INFO] Match candidates: {len(uniq) - len(todo)} cached, {len(todo)} scored ({len(queries)} rows)")
+    rows = np.full((len(queries), k), -1, dtype=np.int64)
+    scores = np.full((len(queries), k), np.nan, dtype=np.float64)
+    for i, q in enumerate(queries):
+        r, sc = known[q]
+        rows[i, :len(r)] = r; scores[i, :len(sc)] = sc
+    return rows, scores
+
+class MatchesTable:
+    """Persisted mxm_779k_matches: memory-mapped string columns plus the MatchIndex over mkey."""
+
+    def __init__(self, cols: dict, index: MatchIndex, meta: dict):
+        self.cols = cols; self.index = index; self.meta = meta
+
+    @property
+    def version(self) -> str:
+        # 匹配结果缓存用它做 key：索引格式版本 + 源文件 hash
+        return f"{self.meta.get('version')}:{self.meta.get('source', {}).get('sha1', '')}"
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, col):
+        return self.cols[col]
+
+    def row(self, i: int) -> dict:
+        return {c: self.cols[c][int(i)] for c in TABLE_COLS}
+
+def save_matches_table(store_dir: Path, df, index: MatchIndex, meta: dict):
+    arrays = {"vocab": index.vocab, "post_ptr": index.post_ptr, "post_rows": index.post_rows}
+    for c in TABLE_COLS:
+        arrays.update(save_strings(c, df[c].tolist()))
+    save_arrays(store_dir, arrays, {**meta, "version": INDEX_VERSION, "rows": int(len(df))})
+
+def open_matches_table(store_dir: Path, src_path: Path):
+    """Load a matches table built from `src_path`; None when it is missing or stale."""
+    meta = fresh_meta(store_dir, src_path, INDEX_VERSION)
+    if not meta:
+        return None
+    names = list(INDEX_ARRAYS) + [f"{c}.{p}" for c in TABLE_COLS for p in ("blob", "offsets")]
+    a = load_arrays(store_dir, names)
+    cols = {c: load_strings(a, c) for c in TABLE_COLS}
+    index = MatchIndex(cols["mkey"], a["vocab"], a["post_ptr"], a["post_rows"])
+    return MatchesTable(cols, index, meta)
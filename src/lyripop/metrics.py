@@ -1,45 +1,126 @@
-import re
+from functools import lru_cache
 import pandas as pd
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import textstat
-from .utils import clean_lyrics, repetition_ratio, compressibility
+from .metrics_cache import MetricsCache, lyrics_hash
+from .parallel import fork_map
+from .textprep import Song
+from .utils import clean_lyrics_series, compressibility
 
-def _ttr(text: str) -> float:
-    toks = re.findall(r"[a-zA-Z']+", (text or "").lower())
-    return (len(set(toks)) / len(toks)) if toks else 0.0
+VADER_CACHE_SIZE = 200_000  # 去重后的歌词行数远小于此，整个语料基本都能留在缓存里
+_ANA = None
 
-def _fk(text: str) -> float:
-    sents = [ln.strip() for ln in (text or "").splitlines() if ln.strip()]
+def _analyzer() -> SentimentIntensityAnalyzer:
+    # 每个进程只建一个 VADER 分析器（加载词典较慢）
+    global _ANA
+    if _ANA is None:
+        _ANA = SentimentIntensityAnalyzer()
+    return _ANA
+
+@lru_cache(maxsize=VADER_CACHE_SIZE)
+def _line_compound(line: str) -> float:
+    # 副歌大量重复、不同歌曲也常有相同的行：同一行只让 VADER 打一次分
+    return _analyzer().polarity_scores(line)["compound"]
+
+def _song(x) -> Song:
+    return x if isinstance(x, Song) else Song(x)
+
+def _ttr(text) -> float:
+    song = _song(text)
+    return (len(song.counts) / len(song.lower)) if song.lower else 0.0
+
+def _fk(text) -> float:
+    sents = _song(text).lines
     if not sents: return 0.0
     block = ". ".join(sents)
     try: return float(textstat.flesch_kincaid_grade(block))
     except Exception: return 0.0
 
-def _vader(text: str, ana=None) -> float:
-    ana = ana or SentimentIntensityAnalyzer()
-    lines = [ln.strip() for ln in (text or "").splitlines() if ln.strip()]
+def _vader(text, ana=None) -> float:
+    """Mean VADER compound over lines; line scores are memoised unless a custom `ana` is given."""
+    lines = _song(text).lines
     if not lines: return 0.0
-    scores = [ana.polarity_scores(ln)["compound"] for ln in lines]
+    if ana is None or ana is _ANA:
+        scores = [_line_compound(ln) for ln in lines]
+    else:
+        scores = [ana.polarity_scores(ln)["compound"] for ln in lines]
     return sum(scores)/len(scores)
 
-def compute_metrics(df: pd.DataFrame) -> pd.DataFrame:
-    ana = SentimentIntensityAnalyzer()
-    rows = []
-    for _, r in df.iterrows():
-        raw = r.get("lyrics_raw", "")
-        if not isinstance(raw, str):
-            raw = ""
-        cln = clean_lyrics(raw)
-        rows.append({
-            **r.to_dict(),
-            "lyrics_clean": cln,
-            "lines": len([ln for ln in cln.splitlines() if ln.strip()]),
-            "tokens": len(re.findall(r"[a-zA-Z']+", cln)),
-            "vader": _vader(cln, ana),
-            "fk_grade": _fk(cln),
-            "ttr": _ttr(cln),
-            "repetition_ratio": repetition_ratio(cln),
-            "compressibility": compressibility(cln),
-            "is_top5": int(r["rank"]) <= 5
-        })
-    return pd.DataFrame(rows)
+def _repetition(text) -> float:
+    lines = _song(text).lines
+    if not lines:
+        return 0.0
+    return 1.0 - (len(set(ln.lower() for ln in lines)) / len(lines))
+
+# 指标 -> (版本, fn(cleaned_text, song))；改了某个指标的算法就把它的版本 +1，缓存只重算这一列
+METRICS = {
+    "lyrics_clean": (1, lambda cln, song: cln),
+    "lines": (1, lambda cln, song: len(song.lines)),
+    "tokens": (1, lambda cln, song: len(song.tokens)),
+    "vader": (1, lambda cln, song: _vader(song)),
+    "fk_grade": (1, lambda cln, song: _fk(song)),
+    "ttr": (1, lambda cln, song: _ttr(song)),
+    "repetition_ratio": (1, lambda cln, song: _repetition(song)),
+    "compressibility": (1, lambda cln, song: compressibility(cln)),
+}
+METRIC_COLS = tuple(METRICS)
+
+def metric_versions() -> dict:
+    """{metric: version tag}; every metric builds on the cleaned text, so its version is part of each tag."""
+    base = METRICS["lyrics_clean"][0]
+    return {m: f"{base}.{v}" for m, (v, _) in METRICS.items()}
+
+def _metrics_chunk(cols, raws) -> list:
+    """Metric columns `cols` for a chunk of raw lyrics, as one {col: [values]} dict."""
+    _analyzer()
+    before = _line_compound.cache_info()
+    fns = [(c, METRICS[c][1]) for c in cols]
+    out = {c: [] for c in cols}
+    for cln in clean_lyrics_series(raws).tolist():
+        song = Song(cln)  # 分行、分词只做一次，各指标共用
+        for c, fn in fns:
+            out[c].append(fn(cln, song))
+    after = _line_compound.cache_info()
+    out["_vader_cache"] = (after.hits - before.hits, after.misses - before.misses)
+    return [out]
+
+def compute_metrics(df: pd.DataFrame, workers: int = 1, cache_path=None) -> pd.DataFrame:
+    """Per-song metrics appended to `df`; chunks of distinct lyrics are scored in `workers` processes.
+
+    With `cache_path`, values are reused from a MetricsCache keyed by the raw-lyrics hash, and
+    only songs (or metric columns) that are new or whose version changed are computed.
+    """
+    raws = df["lyrics_raw"].tolist() if "lyrics_raw" in df.columns else [""] * len(df)
+    raws = [x if isinstance(x, str) else "" for x in raws]
+    hashes = [lyrics_hash(r) for r in raws]
+    uniq = dict(zip(hashes, raws))  # 相同歌词（含大量空串）只算一次
+    versions = metric_versions()
+    cache = MetricsCache(cache_path) if cache_path else None
+    vals = cache.get_many(uniq, versions) if cache else {}
+    # 按缺失的列组合分组：新增一个指标时，已缓存的歌只补这一列
+    todo = {}
+    for h in uniq:
+        miss = tuple(c for c in METRIC_COLS if c not in vals.get(h, {}))
+        if miss:
+            todo.setdefault(miss, []).append(h)
+    hits = misses = 0
+    for cols, hs in todo.items():
+        parts = fork_map(_metrics_chunk, [uniq[h] for h in hs], shared=cols, workers=workers)
+        new = [dict(zip(cols, row)) for p in parts for row in zip(*(p[c] for c in cols))]
+        for h, row in zip(hs, new):
+            vals.setdefault(h, {}).update(row)
+        if cache:
+            cache.put_many(zip(hs, new), versions)
+        hits += sum(p["_vader_cache"][0] for p in parts); misses += sum(p["_vader_cache"][1] for p in parts)
+        print(f"[INFO] Computed {'all metrics' if cols == METRIC_COLS else ', '.join(cols)} for {len(hs)} distinct lyrics")
+    if cache:
+        print(f"[INFO] Metrics cache: {len(uniq) - sum(len(hs) for hs in todo.values())}/{len(uniq)} distinct lyrics fully reused")
+        cache.close()
+    out = df.reset_index(drop=True).copy()
+    for c in METRIC_COLS:
+        out[c] = [vals[h][c] for h in hashes]
+    if hits + misses:
+        print(f"[INFO] VADER line cache: {hits + misses} lines, {misses} scored, "
+              f"hit rate {hits / (hits + misses):.1%}")
+    out["is_top5"] = out["rank"].astype(int) <= 5
+    return out
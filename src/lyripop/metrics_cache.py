@@ -0,0 +1,41 @@
+import hashlib, sqlite3
+from pathlib import Path
+
+def lyrics_hash(raw: str) -> str:
+    return hashlib.sha1((raw or "").encode("utf-8")).hexdigest()
+
+class MetricsCache:
+    """SQLite store of per-song metric values keyed by lyrics_hash(lyrics_raw).
+
+    One row per (hash, metric) with the metric's version tag; a value only counts as cached
+    while its stored version equals the current one, so bumping a version recomputes just
+    that column.
+    """
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        # value 不声明类型：int / float / text 原样存取，读回与现算完全一致
+        self.db.execute("CREATE TABLE IF NOT EXISTS metrics (h TEXT, metric TEXT, version TEXT, value,"
+                        " PRIMARY KEY (h, metric))")
+
+    def get_many(self, hashes, versions: dict) -> dict:
+        """{hash: {metric: value}} of values stored under the current `versions` ({metric: tag})."""
+        hashes = list(dict.fromkeys(hashes)); out = {}
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            cur = self.db.execute(f"SELECT h, metric, version, value FROM metrics WHERE h IN ({','.join('?' * len(part))})",
+                                  part)
+            for h, m, v, val in cur:
+                if versions.get(m) == v:
+                    out.setdefault(h, {})[m] = val
+        return out
+
+    def put_many(self, items, versions: dict):
+        """items: iterable of (hash, {metric: value})."""
+        self.db.executemany("INSERT OR REPLACE INTO metrics VALUES (?,?,?,?)",
+                            [(h, m, versions[m], val) for h, vals in items for m, val in vals.items()])
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,299 @@
+import re
+from array import array
+from pathlib import Path
+import math
+import numpy as np
+import pandas as pd
+
+from .store import read_meta, fresh_meta, save_arrays, load_arrays, source_stamp, csr_take
+
+CACHE_VERSION = 1
+ARRAYS = ("tids", "indptr", "word_id", "count")
+PAIRS_RE = re.compile(r"\d+:\d+(?:,\d+:\d+)*")
+METRIC_COLS = ("total", "ttr", "entropy", "hhi", "max_p")
+
+def _read_vocab(txt_path: Path) -> list:
+    # MXM 文件头：'#' 注释行，'%' 行是逗号分隔的 5000 个词干
+    with Path(txt_path).open("r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            if line.startswith("%"):
+                return [w for w in line[1:].strip().split(",") if w]
+            if line.strip() and not line.startswith("#"):
+                break
+    return []
+
+def _parse_bow_lines(lines):
+    """Parse 'tid,mxm_tid,id:count,...' lines into (tids, indptr, word_id, count).
+
+    Same acceptance rules as the old dict loader: a track is kept if any segment
+    contains ':', and only well-formed pairs with count > 0 contribute entries.
+    """
+    tids = []; lens = array("q"); bodies = []
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in "#%" or "," not in line:
+            continue
+        tid, rest = line.split(",", 1)
+        head, _, body = rest.partition(",")
+        if ":" not in head and PAIRS_RE.fullmatch(body):
+            tids.append(tid); lens.append(body.count(",") + 1); bodies.append(body)
+            continue
+        # 非标准行：逐段校验，跳过无法解析的段，只保留 count > 0 的词
+        has = False; good = []
+        for seg in rest.split(","):
+            w, sep, c = seg.partition(":")
+            if not sep:
+                continue
+            has = True
+            try:
+                c = int(c)
+            except ValueError:
+                continue
+            try:
+                w = int(w)
+            except ValueError:
+                w = 0
+            good.append(f"{w}:{c}")
+        if has:
+            tids.append(tid); lens.append(len(good))
+            if good:
+                bodies.append(",".join(good))
+    flat = np.fromstring(",".join(bodies).replace(":", ","), dtype=np.int64, sep=",") if bodies else np.zeros(0, np.int64)
+    word_id, count = flat[0::2].astype(np.int32), flat[1::2].astype(np.int32)
+    lens = np.frombuffer(lens, dtype=np.int64)
+    # 丢弃 count<=0 的条目后按行重新计长度
+    keep = count > 0
+    if not keep.all():
+        row = np.repeat(np.arange(len(lens)), lens)
+        lens = np.bincount(row[keep], minlength=len(lens))
+        word_id, count = word_id[keep], count[keep]
+    indptr = np.zeros(len(lens) + 1, dtype=np.int64)
+    np.cumsum(lens, out=indptr[1:])
+    return np.array(tids, dtype=str), indptr, word_id, count
+
+def _as_arrays(parsed) -> dict:
+    return dict(zip(ARRAYS, parsed))
+
+def _concat_parsed(chunks) -> dict:
+    """Glue per-chunk parses of one file back together in file order."""
+    lens = np.concatenate([np.diff(c["indptr"]) for c in chunks])
+    indptr = np.zeros(len(lens) + 1, dtype=np.int64)
+    np.cumsum(lens, out=indptr[1:])
+    return {"tids": np.concatenate([c["tids"] for c in chunks]), "indptr": indptr,
+            "word_id": np.concatenate([c["word_id"] for c in chunks]),
+            "count": np.concatenate([c["count"] for c in chunks])}
+
+def _line_ranges(path: Path, n: int) -> list:
+    """Split a file into at most n byte ranges whose boundaries fall right after a newline."""
+    size = path.stat().st_size
+    bounds = [0]
+    with path.open("rb") as f:
+        for k in range(1, n):
+            f.seek(max(k * size // n, bounds[-1]))
+            f.readline()
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _wanted_lines(lines, wanted):
+    return lines if wanted is None else (ln for ln in lines if ln.lstrip().split(",", 1)[0] in wanted)
+
+def _parse_range(path: Path, start: int, end: int, wanted=None) -> dict:
+    with path.open("rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # 与文本模式逐行读取一致：只把 \r\n / \r / \n 当换行
+    text = data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+    return _as_arrays(_parse_bow_lines(_wanted_lines(text.split("\n"), wanted)))
+
+def parse_mxm_files(paths, workers: int = 1, wanted=None) -> list:
+    """Parse several MXM txt files into CSR dicts (one per file, same order as `paths`).
+
+    With workers > 1 every file is cut into line-aligned byte ranges and all ranges of
+    all files are parsed together in one process pool; chunks are merged back in file
+    order, so the result is identical to the serial parse.
+    """
+    paths = [Path(p) for p in paths]
+    if workers <= 1:
+        out = []
+        for p in paths:
+            with p.open("r", encoding="utf-8", errors="ignore") as f:
+                out.append(_as_arrays(_parse_bow_lines(_wanted_lines(f, wanted))))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        jobs = [(i, p, a, b) for i, p in enumerate(paths) for a, b in _line_ranges(p, workers * 4)]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futs = [ex.submit(_parse_range, p, a, b, wanted) for _, p, a, b in jobs]
+            res = [f.result() for f in futs]
+        out = [_concat_parsed([r for (i, *_), r in zip(jobs, res) if i == k]) for k in range(len(paths))]
+    if wanted is None:
+        for p, arrays in zip(paths, out):
+            if not len(arrays["tids"]):
+                raise RuntimeError(f"Failed to parse {p}. Is it the unzipped txt?")
+    return out
+
+def parse_mxm_bow(txt_path: Path, workers: int = 1) -> dict:
+    return parse_mxm_files([txt_path], workers=workers)[0]
+
+def _seq_segment_sum(values, indptr):
+    """Per-segment left-to-right float sums (same rounding as Python's sum() on the segment).
+
+    Segments are ordered by length so that step j only touches the rows that still
+    have a j-th entry; the j-th entries are pre-gathered into one contiguous block.
+    """
+    lens = np.diff(indptr)
+    n = len(lens)
+    out = np.zeros(n, dtype=np.float64)
+    if not n or not lens.max():
+        return out
+    order = np.argsort(-lens, kind="stable")
+    lens_s = lens[order]; starts_s = indptr[:-1][order]
+    # active[j] = 有第 j 个元素的行数（前缀）
+    active = np.searchsorted(-lens_s, -np.arange(lens_s[0]), side="left")
+    offs = np.concatenate([[0], np.cumsum(active)])
+    gather = np.concatenate([starts_s[:k] + j for j, k in enumerate(active)])
+    block = values[gather]
+    acc = np.zeros(n, dtype=np.float64)
+    for j, k in enumerate(active):
+        acc[:k] += block[offs[j]:offs[j + 1]]
+    out[order] = acc
+    return out
+
+def bow_metrics(indptr, count) -> pd.DataFrame:
+    """Per-track BoW metrics over CSR rows, vectorised.
+
+    With p = count / total over a track's positive counts: total, ttr (distinct words / total),
+    entropy (-sum p*ln(p + 1e-12)), hhi (sum p^2) and max_p (max p); all 0 for empty tracks.
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    base = int(indptr[0]) if len(indptr) else 0
+    indptr = indptr - base
+    count = np.asarray(count[base:base + int(indptr[-1])] if len(indptr) else count[:0], dtype=np.int64)
+    lens = np.diff(indptr)
+    nz = lens > 0
+    total = np.zeros(len(lens), dtype=np.int64)
+    peak = np.zeros(len(lens), dtype=np.int64)
+    if nz.any():
+        total[nz] = np.add.reduceat(count, indptr[:-1][nz])
+        peak[nz] = np.maximum.reduceat(count, indptr[:-1][nz])
+    p = count / np.repeat(np.where(total > 0, total, 1), lens)
+    # math.log 与 np.log 末位可能不同；只对不同的 p 值调用 math.log，保证与此前输出的 CSV 逐位一致
+    uniq, inv = np.unique(p, return_inverse=True)
+    logs = np.array([math.log(x + 1e-12) for x in uniq.tolist()], dtype=np.float64)
+    entropy = -_seq_segment_sum(p * logs[inv], indptr)
+    hhi = _seq_segment_sum(p * p, indptr)
+    safe = np.where(total > 0, total, 1)
+    out = pd.DataFrame({
+        "total": total,
+        "ttr": np.where(total > 0, lens / safe, 0.0),
+        "entropy": np.where(total > 0, entropy, 0.0),
+        "hhi": np.where(total > 0, hhi, 0.0),
+        "max_p": np.where(total > 0, peak / safe, 0.0),
+    })
+    return out[list(METRIC_COLS)]
+
+class BowMatrix:
+    """One MXM BoW file in CSR form: track i owns word_id/count[indptr[i]:indptr[i+1]]."""
+
+    def __init__(self, tids, indptr, word_id, count, vocab=()):
+        self.tids = tids; self.indptr = indptr
+        self.word_id = word_id; self.count = count
+        self.vocab = list(vocab)
+
+    def __len__(self):
+        return len(self.tids)
+
+    def row(self, i: int):
+        a, b = int(self.indptr[i]), int(self.indptr[i + 1])
+        return self.word_id[a:b], self.count[a:b]
+
+    def metrics(self, rows=None) -> pd.DataFrame:
+        if rows is None:
+            return bow_metrics(self.indptr, self.count)
+        ptr, pos = csr_take(self.indptr, rows)
+        return bow_metrics(ptr, self.count[pos])
+
+def bow_cache_dir(txt_path: Path) -> Path:
+    txt_path = Path(txt_path)
+    return txt_path.with_name(f"{txt_path.stem}_bowcache")
+
+def _save_bow_cache(txt_path: Path, arrays: dict):
+    cdir = bow_cache_dir(txt_path)
+    meta = {"version": CACHE_VERSION, "source": source_stamp(txt_path),
+            "vocab": _read_vocab(txt_path), "tracks": int(len(arrays["tids"]))}
+    save_arrays(cdir, arrays, meta)
+
+def _load_bow_cache(txt_path: Path) -> BowMatrix:
+    cdir = bow_cache_dir(txt_path)
+    a = load_arrays(cdir, ARRAYS)
+    return BowMatrix(a["tids"], a["indptr"], a["word_id"], a["count"], read_meta(cdir).get("vocab", ()))
+
+class MxmBow:
+    """Read-only tid -> pairs mapping over several BoW files; later files override earlier ones."""
+
+    def __init__(self, parts):
+        self.parts = list(parts)
+        self.index = {}
+        for p, m in enumerate(self.parts):
+            self.index.update(zip(m.tids.tolist(), ((p, i) for i in range(len(m)))))
+
+    def __contains__(self, tid):
+        return tid in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def counts(self, tid):
+        p, i = self.index[tid]
+        return self.parts[p].row(i)
+
+    def get(self, tid, default=None):
+        # 兼容旧的 dict[tid] -> ["id:count", ...] 接口
+        if tid not in self.index:
+            return default
+        w, c = self.counts(tid)
+        return [f"{a}:{b}" for a, b in zip(w.tolist(), c.tolist())]
+
+    def metrics(self, tids=None) -> pd.DataFrame:
+        """bow_metrics() columns for the given track ids (default: every track), in input order."""
+        tids = list(self.index) if tids is None else list(tids)
+        loc = np.array([self.index[t] for t in tids], dtype=np.int64).reshape(-1, 2)
+        out = pd.DataFrame(index=range(len(tids)), columns=list(METRIC_COLS))
+        parts = []
+        for p, m in enumerate(self.parts):
+            sel = np.flatnonzero(loc[:, 0] == p)
+            if len(sel):
+                parts.append(m.metrics(loc[sel, 1]).set_index(pd.Index(sel)))
+        if parts:
+            out = pd.concat(parts).sort_index()
+        out.insert(0, "bow_tid", tids)
+        return out.reset_index(drop=True)
+
+def open_mxm_bow(paths, rebuild: bool = False, workers: int = 1) -> MxmBow:
+    """Open the memory-mapped CSR caches of the given txt files, (re)building stale ones first."""
+    paths = [Path(p) for p in paths]
+    stale = [p for p in paths if rebuild or not fresh_meta(bow_cache_dir(p), p, CACHE_VERSION)]
+    if stale:
+        print(f"[INFO] Building BoW cache for {', '.join(p.name for p in stale)} (workers={workers})")
+        for p, arrays in zip(stale, parse_mxm_files(stale, workers=workers)):
+            _save_bow_cache(p, arrays)
+    return MxmBow(_load_bow_cache(p) for p in paths)
+
+def stream_mxm_bow(paths, wanted, workers: int = 1) -> MxmBow:
+    """Scan the txt files once and keep only rows whose track id is in `wanted`.
+
+    Peak memory is bounded by the wanted rows (plus one chunk per worker), not by
+    the size of the dataset; no cache is read or written.
+    """
+    paths = [Path(p) for p in paths]
+    parsed = parse_mxm_files(paths, workers=workers, wanted=set(wanted))
+    return MxmBow(BowMatrix(a["tids"], a["indptr"], a["word_id"], a["count"], _read_vocab(p))
+                  for p, a in zip(paths, parsed))
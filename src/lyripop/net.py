@@ -0,0 +1,250 @@
+import hashlib, json, os, random, sqlite3, threading, time, zlib
+from pathlib import Path
+from urllib.parse import urlsplit, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate); self.burst = max(1, int(burst))
+        self.tokens = float(self.burst); self.t = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Cassette:
+    """SQLite store of recorded GET responses, keyed by URL + query params (headers ignored).
+
+    mode "record": requests go to the network and every response is stored (latest wins), except
+    304s: they answer a conditional request from a warm cache and would shadow the recorded body.
+    mode "replay": responses come from the store at disk speed, after an optional injected
+    `latency` (mean seconds, uniform 0.5-1.5x) and with an `error_rate` share of synthetic
+    503s; a request that was never recorded raises requests.ConnectionError.
+    """
+
+    def __init__(self, path: Path, mode: str = "replay", latency: float = 0.0, error_rate: float = 0.0,
+                 seed: int = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.mode = mode; self.latency = latency; self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(Path(path) / "cassette.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, status INTEGER,"
+                        " headers TEXT, body BLOB, recorded_at REAL)")
+        self.stats = {"hits": 0, "misses": 0, "errors": 0, "recorded": 0}
+
+    @staticmethod
+    def key(url: str, params=None) -> str:
+        q = urlencode(sorted(params.items()) if isinstance(params, dict) else (params or []))
+        return hashlib.sha1(f"GET {url}?{q}".encode("utf-8")).hexdigest()
+
+    def record(self, key: str, r: requests.Response):
+        if r.status_code == 304:
+            return
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?)",
+                            (key, r.url, r.status_code, json.dumps(dict(r.headers)), zlib.compress(r.content),
+                             time.time()))
+            self.db.commit()
+            self.stats["recorded"] += 1
+
+    def replay(self, key: str, url: str) -> requests.Response:
+        with self.lock:
+            row = self.db.execute("SELECT status, headers, body FROM responses WHERE key=?", (key,)).fetchone()
+            fail = self.rng.random() < self.error_rate
+            wait = self.latency * (0.5 + self.rng.random()) if self.latency else 0.0
+        if wait:
+            time.sleep(wait)
+        with self.lock:
+            self.stats["misses" if row is None else "errors" if fail else "hits"] += 1
+        if row is None:
+            raise requests.ConnectionError(f"cassette miss: {url}")
+        r = requests.Response()
+        r.url = url
+        if fail:
+            r.status_code, r._content, r.headers = 503, b"injected error", CaseInsensitiveDict()
+            return r
+        r.status_code, r._content = row[0], zlib.decompress(row[2])
+        r.headers = CaseInsensitiveDict(json.loads(row[1]))
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers) or "utf-8"
+        return r
+
+    def close(self):
+        self.db.close()
+
+class CassetteSession:
+    """Session stand-in routing get() through a Cassette (record: via the wrapped session)."""
+
+    def __init__(self, session: requests.Session, cassette: Cassette):
+        self.session = session; self.cassette = cassette
+        self.headers = session.headers
+
+    def get(self, url, params=None, **kw):
+        key = Cassette.key(url, params)
+        if self.cassette.mode == "replay":
+            return self.cassette.replay(key, url)
+        r = self.session.get(url, params=params, **kw)
+        self.cassette.record(key, r)
+        return r
+
+    def close(self):
+        self.session.close()
+
+_CASSETTE = None
+
+def use_cassette(path: Path = None, mode: str = "replay", **kw) -> Cassette:
+    """Route every pooled_session() through a Cassette at `path` (None switches it off)."""
+    global _CASSETTE
+    _CASSETTE = Cassette(path, mode, **kw) if path else None
+    return _CASSETTE
+
+def pooled_session(pool_size: int = 10, headers: dict = None):
+    # 所有线程共用一个 Session：keep-alive 连接复用，连接池大小与并发数一致
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    s.mount("http://", adapter); s.mount("https://", adapter)
+    if headers:
+        s.headers.update(headers)
+    if _CASSETTE is None and os.getenv("LYRIPOP_CASSETTE"):
+        # 环境变量开启录制/回放：所有抓取脚本无需改参数
+        use_cassette(os.getenv("LYRIPOP_CASSETTE"), os.getenv("LYRIPOP_CASSETTE_MODE", "replay"),
+                     latency=float(os.getenv("LYRIPOP_CASSETTE_LATENCY", 0)),
+                     error_rate=float(os.getenv("LYRIPOP_CASSETTE_ERROR_RATE", 0)))
+    return CassetteSession(s, _CASSETTE) if _CASSETTE else s
+
+class ThrottledSession:
+    """requests.Session wrapper whose get() first takes a token from a shared TokenBucket."""
+
+    def __init__(self, session: requests.Session = None, bucket: TokenBucket = None, pool_size: int = 10):
+        self.session = session or pooled_session(pool_size)
+        self.bucket = bucket
+
+    def get(self, url, **kw):
+        if self.bucket:
+            self.bucket.acquire()
+        return self.session.get(url, **kw)
+
+    def close(self):
+        self.session.close()
+
+class HostLimiter:
+    """Per-host politeness for a shared session: at most `concurrency` requests in flight and
+    `rate` requests/s to any one host; different hosts do not wait for each other."""
+
+    def __init__(self, session: requests.Session = None, rate: float = 1.0, concurrency: int = 2):
+        self.session = session or pooled_session(max(4, concurrency * 2))
+        self.rate = rate; self.concurrency = concurrency
+        self.hosts = {}; self.lock = threading.Lock()
+
+    def _host(self, url):
+        h = urlsplit(url).netloc
+        with self.lock:
+            if h not in self.hosts:
+                self.hosts[h] = (TokenBucket(self.rate), threading.BoundedSemaphore(self.concurrency))
+            return self.hosts[h]
+
+    def get(self, url, **kw):
+        bucket, sem = self._host(url)
+        with sem:
+            bucket.acquire()
+            return self.session.get(url, **kw)
+
+    def close(self):
+        self.session.close()
+
+def conditional_headers(meta: dict) -> dict:
+    """If-None-Match / If-Modified-Since from the validators saved with an earlier response."""
+    h = {}
+    if meta.get("etag"):
+        h["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        h["If-Modified-Since"] = meta["last_modified"]
+    return h
+
+TRANSIENT_STATUS = {403, 408, 425, 429, 500, 502, 503, 504}
+
+class TransientHTTPError(Exception):
+    """Raised when a request still fails with a transient status / network error after all retries."""
+
+class FetchJournal:
+    """Append-only JSONL log of HTTP attempts and fetch outcomes; one flushed line per event."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.f = self.path.open("a", encoding="utf-8")
+
+    def log(self, **rec):
+        line = json.dumps({"ts": round(time.time(), 3), **rec}, ensure_ascii=False)
+        with self.lock:
+            self.f.write(line + "\n"); self.f.flush()
+
+    def records(self):
+        if not self.path.exists():
+            return
+        with self.path.open(encoding="utf-8") as f:
+            for ln in f:
+                try:
+                    yield json.loads(ln)
+                except ValueError:
+                    continue  # 被中断时写了一半的行
+
+    def compact(self, select):
+        """Rotate the log to <name>.1 and restart it with select(records), e.g. still-pending work."""
+        with self.lock:
+            self.f.close()
+            keep = list(select(self.records()))
+            os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+            with self.path.open("w", encoding="utf-8") as f:
+                f.writelines(json.dumps(rec, ensure_ascii=False) + "\n" for rec in keep)
+            self.f = self.path.open("a", encoding="utf-8")
+
+    def close(self):
+        self.f.close()
+
+def get_with_retry(http, url, journal: FetchJournal = None, tag: dict = None, retries: int = 3,
+                   backoff: float = 1.0, **kw):
+    """http.get() retried with exponential backoff on network errors and TRANSIENT_STATUS.
+
+    Every attempt is journaled with its status and latency. Non-transient responses (200, 404,
+    401, ...) are returned as is; TransientHTTPError is raised once `retries` are used up.
+    """
+    tag = tag or {}
+    for attempt in range(retries + 1):
+        t0 = time.monotonic()
+        try:
+            r = http.get(url, **kw); status, err = r.status_code, None
+        except requests.RequestException as e:
+            r, status, err = None, None, type(e).__name__
+        transient = r is None or status in TRANSIENT_STATUS
+        if journal:
+            journal.log(**tag, url=url, status=status, error=err, attempt=attempt,
+                        latency=round(time.monotonic() - t0, 3),
+                        outcome=("retry" if attempt < retries else "error") if transient else "ok")
+        if not transient:
+            return r
+        if attempt < retries:
+            wait = backoff * 2 ** attempt * (1 + random.random())
+            ra = r.headers.get("Retry-After", "") if r is not None else ""
+            if ra.isdigit():
+                wait = max(wait, float(ra))
+            time.sleep(wait)
+    raise TransientHTTPError(f"{url}: {status or err}")
@@ -0,0 +1,29 @@
+import multiprocessing as mp
+
+_SHARED = None
+
+def _run_chunk(args):
+    fn, chunk = args
+    return fn(_SHARED, chunk)
+
+def fork_map(fn, items, shared=None, workers: int = 1, chunks_per_worker: int = 4) -> list:
+    """fn(shared, chunk) -> list, applied to contiguous chunks of `items`; results in input order.
+
+    `shared` (a read-only index, candidate table, ...) is handed to forked workers through
+    copy-on-write memory instead of being pickled per task. Falls back to a single
+    in-process call when workers <= 1 or the platform cannot fork, so output never
+    depends on the worker count.
+    """
+    global _SHARED
+    items = list(items)
+    if workers <= 1 or len(items) < 2 or "fork" not in mp.get_all_start_methods():
+        return list(fn(shared, items))
+    n = min(len(items), workers * chunks_per_worker)
+    bounds = [len(items) * k // n for k in range(n + 1)]
+    _SHARED = shared
+    try:
+        with mp.get_context("fork").Pool(processes=workers) as pool:
+            parts = pool.map(_run_chunk, [(fn, items[a:b]) for a, b in zip(bounds[:-1], bounds[1:])])
+    finally:
+        _SHARED = None
+    return [x for part in parts for x in part]
@@ -1,10 +1,151 @@
-import argparse
+import argparse, re
 from pathlib import Path
 import pandas as pd
-from tqdm import tqdm
-from .charts import fetch_year_end_hot100
-from .lyrics import fetch_lyrics_for_chart
+from .archive import HtmlArchive
+from .charts import fetch_year_end_hot100_years, reparse_year_end_hot100
+from .lyrics import fetch_lyrics_for_chart, reparse_lyrics
 from .metrics import compute_metrics
+from .tables import FORMATS, find_table, read_table, write_table
+
+CHECKPOINTS = ("charts", "lyrics", "metrics")
+
+class Pipeline:
+    """Year-End Hot 100 pipeline run in one process.
+
+    Stages hand their tables to each other in memory (self.charts / self.lyrics / self.metrics);
+    a table is written to <outdir> only when its name is in `checkpoints`, as `fmt` ("parquet" or
+    "csv"). A stage whose input was not produced in this run falls back to the checkpoint file
+    from an earlier run, in either format.
+    """
+
+    def __init__(self, outdir="data_out", start: int = 1980, end: int = 2024, workers: int = 4, rate: float = 3.0,
+                 host_rate: float = 1.0, retries: int = 3, negative_ttl_days: float = 30, archive_dir=None,
+                 metrics_cache: bool = True, checkpoints=CHECKPOINTS, fmt: str = "parquet"):
+        self.outdir = Path(outdir); self.outdir.mkdir(parents=True, exist_ok=True)
+        self.start = start; self.end = end; self.years = range(start, end + 1)
+        self.workers = workers; self.rate = rate; self.host_rate = host_rate; self.retries = retries
+        self.negative_ttl = negative_ttl_days * 86400; self.metrics_cache = metrics_cache
+        unknown = set(checkpoints) - set(CHECKPOINTS)
+        if unknown:
+            raise ValueError(f"Unknown checkpoints: {sorted(unknown)}")
+        self.checkpoints = set(checkpoints)
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown table format: {fmt}")
+        self.fmt = fmt
+        self.charts_path = self.outdir / f"yearend_hot100_{start}_{end}.{fmt}"
+        self.lyrics_path = self.outdir / f"yearend_hot100_lyrics_{start}_{end}.{fmt}"
+        self.metrics_path = self.outdir / f"yearend_hot100_metrics_{start}_{end}.{fmt}"
+        self.lyrics_db = self.outdir / "lyrics_cache.sqlite"
+        self.archive_dir = Path(archive_dir) if archive_dir else self.outdir / "_archive"
+        self._archive = None
+        self.charts = self.lyrics = self.metrics = None
+
+    @property
+    def archive(self) -> HtmlArchive:
+        if self._archive is None:
+            self._archive = HtmlArchive(self.archive_dir)
+        return self._archive
+
+    def _checkpoint(self, name: str, df: pd.DataFrame, path: Path):
+        if name in self.checkpoints:
+            write_table(df, path)
+            print(f"[OK] {len(df)} rows -> {path}")
+
+    def _charts(self) -> pd.DataFrame:
+        if self.charts is None:
+            path = find_table(self.charts_path)
+            if not path.exists():
+                raise SystemExit(f"[ERROR] Missing charts table: {self.charts_path}. Run --fetch_charts first.")
+            self.charts = read_table(path)
+        return self.charts
+
+    def fetch_charts(self) -> pd.DataFrame:
+        # 逐年缓存 + 条件请求：已定稿的年份不再请求，新增一年只多一次请求
+        by_year = fetch_year_end_hot100_years(self.years, self.outdir / "_cache" / "charts", workers=self.workers,
+                                              host_rate=self.host_rate, archive=self.archive)
+        frames = []
+        for y in self.years:
+            df_y = by_year.get(y)
+            if df_y is None or df_y.empty:
+                print(f"[WARN] No rows for {y}. Check the archived page in {self.archive.root}.")
+                continue
+            frames.append(df_y)
+        if not frames:
+            raise SystemExit("[ERROR] No charts fetched. Aborting.")
+        self.charts = pd.concat(frames, ignore_index=True)
+        self._checkpoint("charts", self.charts, self.charts_path)
+        return self.charts
+
+    def reparse(self):
+        # 旧版只在 _html/ 里留了部分榜单页：先并入存档（内容寻址，重复导入无副作用）
+        legacy = {m.group(1): fp for fp in sorted((self.outdir / "_html").glob("billboard_yearend_*.html"))
+                  if (m := re.search(r"_(\d{4})\.html$", fp.name))}
+        self.archive.import_files("chart", legacy)
+        parsed = reparse_year_end_hot100(self.archive, self.years, workers=self.workers)
+        old_path = find_table(self.charts_path)
+        old = read_table(old_path) if old_path.exists() else None
+        frames = []
+        for y in self.years:
+            if y in parsed and not parsed[y].empty:
+                frames.append(parsed[y])
+            elif old is not None and (old["year"] == y).any():
+                print(f"[WARN] No archived chart page for {y}; keeping rows from {old_path}")
+                frames.append(old[old["year"] == y])
+        if not frames:
+            print("[WARN] Nothing archived for the requested years.")
+            return
+        self.charts = pd.concat(frames, ignore_index=True)
+        print(f"[OK] Re-parsed {len(parsed)} chart pages")
+        self._checkpoint("charts", self.charts, self.charts_path)
+        n = reparse_lyrics(self.archive, self.lyrics_db, workers=self.workers)
+        self.lyrics = fetch_lyrics_for_chart(self.charts, self.lyrics_db, legacy_dir=self.outdir / "lyrics_cache",
+                                             offline=True)
+        print(f"[OK] Re-parsed {n} lyric pages")
+        self._checkpoint("lyrics", self.lyrics, self.lyrics_path)
+
+    def fetch_lyrics(self, charts: pd.DataFrame = None) -> pd.DataFrame:
+        charts = self._charts() if charts is None else charts
+        self.lyrics = fetch_lyrics_for_chart(charts, self.lyrics_db, workers=self.workers, rate=self.rate,
+                                             legacy_dir=self.outdir / "lyrics_cache",
+                                             journal_path=self.outdir / "lyrics_fetch_journal.jsonl",
+                                             retries=self.retries, negative_ttl=self.negative_ttl, archive=self.archive)
+        self._checkpoint("lyrics", self.lyrics, self.lyrics_path)
+        return self.lyrics
+
+    def compute(self, base: pd.DataFrame = None) -> pd.DataFrame:
+        if base is None:
+            # 本次运行产出的表直接用；否则读上次的检查点（歌词表优先）
+            base = self.lyrics
+            if base is None:
+                path = find_table(self.lyrics_path)
+                base = read_table(path) if path.exists() else self._charts()
+        base = base.fillna({"lyrics_raw": ""})
+        self.metrics = compute_metrics(base, workers=self.workers,
+                                       cache_path=self.outdir / "_cache" / "metrics.sqlite" if self.metrics_cache else None)
+        if "metrics" in self.checkpoints:
+            write_table(self.metrics, self.metrics_path)
+            write_table(self.metrics[self.metrics["is_top5"] == 1], self.outdir / f"top5_metrics.{self.fmt}")
+            write_table(self.metrics[self.metrics["is_top5"] == 0], self.outdir / f"non_top5_metrics.{self.fmt}")
+            print(f"[OK] Metrics saved -> {self.metrics_path} (+ splits)")
+        return self.metrics
+
+    def run(self, fetch_charts=False, reparse=False, fetch_lyrics=False, compute=False):
+        try:
+            if fetch_charts:
+                self.fetch_charts()
+            if reparse:
+                self.reparse()
+            if fetch_lyrics:
+                self.fetch_lyrics()
+            if compute:
+                self.compute()
+        finally:
+            self.close()
+        return self
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close(); self._archive = None
 
 def main():
     ap = argparse.ArgumentParser(description="LyriPop v2: Year-End Hot 100 lyrics pipeline")
@@ -14,42 +155,26 @@ def main():
     ap.add_argument("--fetch_charts", action="store_true")
     ap.add_argument("--fetch_lyrics", action="store_true")
     ap.add_argument("--compute", action="store_true")
+    ap.add_argument("--reparse", action="store_true",
+                    help="Rebuild charts + lyrics from the raw page archive (no network)")
+    ap.add_argument("--archive_dir", default=None, help="Raw page archive (default: <outdir>/_archive)")
+    ap.add_argument("--workers", type=int, default=4, help="Concurrent fetches / processes for --reparse and --compute")
+    ap.add_argument("--rate", type=float, default=3.0, help="Max HTTP requests per second while fetching lyrics")
+    ap.add_argument("--host_rate", type=float, default=1.0, help="Max chart requests per second per host")
+    ap.add_argument("--retries", type=int, default=3, help="Retries per request on network errors / 403 / 429 / 5xx")
+    ap.add_argument("--negative_ttl_days", type=float, default=30, help="Re-search songs not found after this many days")
+    ap.add_argument("--checkpoints", default=",".join(CHECKPOINTS),
+                    help="Tables written to <outdir>: comma-separated subset of charts,lyrics,metrics")
+    ap.add_argument("--format", choices=FORMATS, default="parquet",
+                    help="Checkpoint table format (Parquet: typed columns; CSV: plain-text export)")
+    ap.add_argument("--no_metrics_cache", action="store_true", help="Recompute every metric instead of reusing cached values")
     args = ap.parse_args()
 
-    outdir = Path(args.outdir); outdir.mkdir(parents=True, exist_ok=True)
-    charts_csv = outdir / f"yearend_hot100_{args.start}_{args.end}.csv"
-    lyrics_csv = outdir / f"yearend_hot100_lyrics_{args.start}_{args.end}.csv"
-    metrics_csv = outdir / f"yearend_hot100_metrics_{args.start}_{args.end}.csv"
-
-    if args.fetch_charts:
-        frames = []
-        for y in tqdm(range(args.start, args.end+1), desc="Year-End Hot 100"):
-            df_y = fetch_year_end_hot100(y, fallback_dir=outdir/"_html")
-            if df_y is None or df_y.empty:
-                print(f"[WARN] No rows for {y}. Check saved HTML in {outdir/'_html'}.")
-                continue
-            frames.append(df_y)
-        if not frames:
-            raise SystemExit("[ERROR] No charts fetched. Aborting.")
-        charts = pd.concat(frames, ignore_index=True)
-        charts.to_csv(charts_csv, index=False)
-        print(f"[OK] {len(charts)} rows -> {charts_csv}")
-
-    if args.fetch_lyrics:
-        if not charts_csv.exists():
-            raise SystemExit(f"[ERROR] Missing charts CSV: {charts_csv}. Run --fetch_charts first.")
-        charts = pd.read_csv(charts_csv)
-        lyrics_df = fetch_lyrics_for_chart(charts, outdir / "lyrics_cache")
-        lyrics_df.to_csv(lyrics_csv, index=False)
-        print(f"[OK] {len(lyrics_df)} rows -> {lyrics_csv}")
-
-    if args.compute:
-        base_df = (pd.read_csv(lyrics_csv) if lyrics_csv.exists() else pd.read_csv(charts_csv)).fillna({"lyrics_raw": ""})
-        metrics = compute_metrics(base_df)
-        metrics.to_csv(metrics_csv, index=False)
-        metrics[metrics["is_top5"] == 1].to_csv(outdir / "top5_metrics.csv", index=False)
-        metrics[metrics["is_top5"] == 0].to_csv(outdir / "non_top5_metrics.csv", index=False)
-        print(f"[OK] Metrics saved -> {metrics_csv} (+ splits)")
+    Pipeline(args.outdir, args.start, args.end, workers=args.workers, rate=args.rate, host_rate=args.host_rate,
+             retries=args.retries, negative_ttl_days=args.negative_ttl_days, archive_dir=args.archive_dir,
+             metrics_cache=not args.no_metrics_cache, checkpoints=[c for c in args.checkpoints.split(",") if c],
+             fmt=args.format).run(fetch_charts=args.fetch_charts, reparse=args.reparse,
+                                  fetch_lyrics=args.fetch_lyrics, compute=args.compute)
 
 if __name__ == "__main__":
     main()
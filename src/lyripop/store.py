@@ -0,0 +1,120 @@
+import json, os, shutil, hashlib
+from pathlib import Path
+import numpy as np
+
+META_NAME = "meta.json"
+
+def file_sha1(path: Path, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with Path(path).open("rb") as f:
+        for blk in iter(lambda: f.read(chunk), b""):
+            h.update(blk)
+    return h.hexdigest()
+
+def source_stamp(path: Path) -> dict:
+    st = Path(path).stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": file_sha1(path)}
+
+def stamp_matches(stamp: dict, path: Path) -> bool:
+    # size 不同必然失效；mtime 相同视为未变；mtime 变了再比 hash（touch/拷贝不触发重建）
+    if not stamp:
+        return False
+    try:
+        st = Path(path).stat()
+    except OSError:
+        return False
+    if st.st_size != stamp.get("size"):
+        return False
+    if st.st_mtime_ns == stamp.get("mtime_ns"):
+        return True
+    return file_sha1(path) == stamp.get("sha1")
+
+def read_meta(store_dir: Path) -> dict:
+    fp = Path(store_dir) / META_NAME
+    if not fp.exists():
+        return {}
+    try:
+        return json.loads(fp.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+def write_meta(store_dir: Path, meta: dict):
+    (Path(store_dir) / META_NAME).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+def fresh_meta(store_dir: Path, src_path: Path, version) -> dict:
+    """meta.json of a store built from `src_path` at `version`, or {} if missing/stale."""
+    meta = read_meta(store_dir)
+    if meta.get("version") != version or not stamp_matches(meta.get("source"), src_path):
+        return {}
+    mtime = Path(src_path).stat().st_mtime_ns
+    if mtime != meta["source"]["mtime_ns"]:
+        # 内容 hash 未变，仅 mtime 变了：刷新 mtime，下次不必再算 hash
+        meta["source"]["mtime_ns"] = mtime
+        write_meta(store_dir, meta)
+    return meta
+
+def save_arrays(store_dir: Path, arrays: dict, meta: dict):
+    """Write each array as <name>.npy plus meta.json; swap the directory in atomically."""
+    store_dir = Path(store_dir)
+    tmp = store_dir.with_name(store_dir.name + f".tmp{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, arr in arrays.items():
+        np.save(tmp / f"{name}.npy", np.asarray(arr), allow_pickle=False)
+    write_meta(tmp, meta)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp, store_dir)
+
+def load_arrays(store_dir: Path, names, mmap: bool = True) -> dict:
+    mode = "r" if mmap else None
+    return {n: np.load(Path(store_dir) / f"{n}.npy", mmap_mode=mode, allow_pickle=False) for n in names}
+
+def csr_take(indptr, rows):
+    """CSR sub-selection: (new indptr, positions into the value arrays) for the given rows."""
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = np.asarray(indptr[rows], dtype=np.int64)
+    lens = np.asarray(indptr[rows + 1], dtype=np.int64) - starts
+    new_ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lens, out=new_ptr[1:])
+    pos = np.repeat(starts - new_ptr[:-1], lens) + np.arange(new_ptr[-1])
+    return new_ptr, pos
+
+class StrColumn:
+    """Read-only string column over a (possibly memory-mapped) utf-8 blob + offsets."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob; self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            if i < 0:
+                i += len(self)
+            return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+        return np.array(self.take(i), dtype=object)
+
+    def take(self, rows) -> list:
+        # 一次 gather 所需字节，用 \x00 分隔后整体 decode，避免逐条切片
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return []
+        ptr, pos = csr_take(self.offsets, rows)
+        lens = np.diff(ptr)
+        buf = np.zeros(int(ptr[-1]) + len(rows) - 1, dtype=np.uint8)
+        buf[np.arange(pos.size) + np.repeat(np.arange(len(rows)), lens)] = self.blob[pos]
+        return buf.tobytes().decode("utf-8").split("\x00")
+
+    def tolist(self) -> list:
+        return self.take(np.arange(len(self)))
+
+def save_strings(prefix: str, values) -> dict:
+    """Variable-length strings as one utf-8 byte blob plus offsets, ready for save_arrays()."""
+    enc = [str(v).encode("utf-8") for v in values]
+    offs = np.zeros(len(enc) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in enc], out=offs[1:])
+    return {f"{prefix}.blob": np.frombuffer(b"".join(enc), dtype=np.uint8), f"{prefix}.offsets": offs}
+
+def load_strings(arrays: dict, prefix: str) -> StrColumn:
+    return StrColumn(arrays[f"{prefix}.blob"], arrays[f"{prefix}.offsets"])
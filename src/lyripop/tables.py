@@ -0,0 +1,62 @@
+from pathlib import Path
+import pandas as pd
+
+# Parquet 里的列类型：小整数年份/名次、字典编码的标题/艺人；歌词等长文本各自单独成列
+INT_COLS = ("year", "rank")
+CATEGORY_COLS = ("title", "artist", "title_mxm", "artist_mxm")
+FORMATS = ("parquet", "csv")
+ROW_GROUP_SIZE = 2000  # 榜单按年排好序，约 20 年一个 row group：年份过滤可以整组跳过
+
+def find_table(path) -> Path:
+    """`path` if it exists, else the same table in the other format if that exists, else `path`."""
+    path = Path(path)
+    if path.exists():
+        return path
+    for fmt in FORMATS:
+        alt = path.with_suffix(f".{fmt}")
+        if alt.exists():
+            return alt
+    return path
+
+def typed(df: pd.DataFrame) -> pd.DataFrame:
+    """Compact dtypes for storage: int16 year/rank (Int16 if missing values), categorical names."""
+    df = df.copy()
+    for c in INT_COLS:
+        if c in df.columns and pd.api.types.is_numeric_dtype(df[c]) and (df[c].dropna() % 1 == 0).all():
+            df[c] = df[c].astype("Int16" if df[c].isna().any() else "int16")
+    for c in CATEGORY_COLS:
+        if c in df.columns and df[c].dtype == object:
+            df[c] = df[c].astype("category")
+    return df
+
+def write_table(df: pd.DataFrame, path):
+    """Write `df` as Parquet (typed, zstd) or CSV, chosen by the file suffix."""
+    path = Path(path); path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        typed(df).to_parquet(path, index=False, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+    else:
+        df.to_csv(path, index=False)
+
+def read_table(path, columns=None, years=None, ranks=None) -> pd.DataFrame:
+    """Read a Parquet or CSV table (see find_table), optionally projected and row-filtered.
+
+    columns: only these columns (ones the file lacks are skipped); years / ranks: inclusive
+    (lo, hi) ranges. For Parquet both are pushed down to the reader, so untouched columns and
+    row groups outside the range are never decoded.
+    """
+    path = find_table(path)
+    ranges = [(c, r) for c, r in (("year", years), ("rank", ranks)) if r is not None]
+    if path.suffix == ".parquet":
+        if columns is not None:
+            import pyarrow.parquet as pq
+            have = set(pq.read_schema(path).names)
+            columns = [c for c in columns if c in have]
+        filters = [f for c, (lo, hi) in ranges for f in ((c, ">=", lo), (c, "<=", hi))] or None
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    keep = None if columns is None else set(columns) | {c for c, _ in ranges}
+    df = pd.read_csv(path, usecols=None if keep is None else (lambda c: c in keep))
+    for c, (lo, hi) in ranges:
+        df = df[df[c].between(lo, hi)]
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df.reset_index(drop=True) if ranges else df
@@ -0,0 +1,52 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+TOKEN_RE = re.compile(r"[a-zA-Z']+")
+STEM_TOKEN_RE = re.compile(r"[a-z]+'?[a-z]*")  # stem 级指标：文本已小写，词内最多一个撇号
+
+try:
+    from nltk.stem import PorterStemmer
+    _STEMMER = PorterStemmer()
+except Exception:
+    _STEMMER = None
+
+class Song:
+    """A cleaned lyric split once, shared by every per-song metric.
+
+    lines: stripped non-empty lines; tokens: regex tokens in original case; lower / counts
+    (lowercased tokens and their Counter) are computed on first use.
+    """
+
+    __slots__ = ("text", "lines", "tokens", "_lower", "_counts")
+
+    def __init__(self, text: str, token_re=TOKEN_RE):
+        self.text = text or ""
+        self.lines = [s for s in (ln.strip() for ln in self.text.splitlines()) if s]
+        self.tokens = token_re.findall(self.text)
+        self._lower = None; self._counts = None
+
+    @property
+    def lower(self) -> list:
+        if self._lower is None:
+            self._lower = [t.lower() for t in self.tokens]
+        return self._lower
+
+    @property
+    def counts(self) -> Counter:
+        if self._counts is None:
+            self._counts = Counter(self.lower)
+        return self._counts
+
+def clean_tokens(text: str) -> list:
+    """Lowercased word tokens of a cleaned lyric."""
+    return Song(text).lower
+
+@lru_cache(maxsize=None)
+def stem(token: str) -> str:
+    # 词表有限而重复极多：每个词只 stem 一次
+    return _STEMMER.stem(token) if _STEMMER else token
+
+def stem_tokens(tokens) -> list:
+    """Porter stems of `tokens` (unchanged when nltk is not installed)."""
+    return [stem(t) for t in tokens] if _STEMMER else list(tokens)
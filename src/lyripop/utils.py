@@ -1,9 +1,19 @@
 import re, html, io, gzip
+import pandas as pd
 from unidecode import unidecode
+from .keys import normalise_artist, normalise_title  # noqa: F401  旧的导入路径
 
 BRACKET_RE = re.compile(r"\[[^\]]{1,40}\]")
 NON_ASCII_RE = re.compile(r"[^\x00-\x7F]+")
 SAFE_FN_RE = re.compile(r"[^a-zA-Z0-9._-]+")
+BLANK_RUN_RE = re.compile(r"\n\n\n+")  # 即 \n{3,}；写成字面前缀，re 能快速定位
+SPACE_RUN_RE = re.compile(r"[ \t]{2,}")
+YMAL_LINE_RE = re.compile(r"(?im)^.*you might also like.*$")
+EMBED_LINE_RE = re.compile(r"(?im)^.*embed$")
+# 批量清洗用的合并模式。非 ASCII 串先变成空格，随后连续空白又被压成一个空格，
+# 所以两步可以合成一次：长度 >=2 的 [空白或非 ASCII] 串，以及单个非 ASCII 字符，都替换成 " "
+WS_RUN_RE = re.compile(r"[ \t\x80-\U0010FFFF]{2,}|[\x80-\U0010FFFF]")
+JUNK_LINE_RE = re.compile(r"(?im)^.*you might also like.*$|^.*embed$")
 
 def slugify(text: str) -> str:
     s = unidecode(text or "").strip().lower()
@@ -21,12 +31,31 @@ def clean_lyrics(raw: str) -> str:
     s = s.replace("\r", "\n")
     s = s.replace("\u2005"," ").replace("\u2009"," ").replace("\u00a0"," ")
     s = NON_ASCII_RE.sub(" ", s)             # ASCII
-    s = re.sub(r"\n{3,}", "\n\n", s)
-    s = re.sub(r"[ \t]{2,}", " ", s)
-    s = re.sub(r"(?im)^.*you might also like.*$", "", s)
-    s = re.sub(r"(?im)^.*embed$", "", s)
+    s = BLANK_RUN_RE.sub("\n\n", s)
+    s = SPACE_RUN_RE.sub(" ", s)
+    s = YMAL_LINE_RE.sub("", s)
+    s = EMBED_LINE_RE.sub("", s)
     return s.strip()
 
+def clean_lyrics_series(raws) -> pd.Series:
+    """clean_lyrics over a Series / list of lyrics, with its substitutions fused into four regex passes.
+
+    Output is identical to clean_lyrics row for row (non-strings give "").
+    """
+    s = raws.astype(object) if isinstance(raws, pd.Series) else pd.Series(list(raws), dtype=object)
+    s = s.where(s.map(lambda x: isinstance(x, str)), "")
+    s = s.map(html.unescape)
+    s = s.str.replace(BRACKET_RE, " ", regex=True)          # [Chorus]
+    s = s.str.replace("\r", "\n", regex=False)
+    # 正则只跑在可能命中的行上；先用 C 层的 isascii / 子串查找筛一遍，比逐字符正则扫描快得多
+    m = ~s.map(str.isascii).astype(bool) | s.str.contains("  ", regex=False) | s.str.contains("\t", regex=False)
+    s[m] = s[m].str.replace(WS_RUN_RE, " ", regex=True)     # 特殊空格 + 非 ASCII + 连续空白
+    s = s.str.replace(BLANK_RUN_RE, "\n\n", regex=True)
+    low = s.str.lower()  # 此时已全是 ASCII，lower 与 (?i) 等价
+    m = low.str.contains("you might also like", regex=False) | low.str.contains("embed", regex=False)
+    s[m] = s[m].str.replace(JUNK_LINE_RE, "", regex=True)
+    return s.str.strip()
+
 def repetition_ratio(text: str) -> float:
     lines = [ln.strip().lower() for ln in (text or "").splitlines() if ln.strip()]
     if not lines:
@@ -44,15 +73,3 @@ def compressibility(text: str) -> float:
     comp = out.getvalue()
     ratio = 1.0 - (len(comp) / max(1, len(raw)))
     return max(0.0, min(1.0, ratio))
-
-def normalise_artist(artist: str) -> str:
-    import re
-    a = re.split(r"feat\.|featuring|with|&|,|\(|\)", artist or "", maxsplit=1, flags=re.I)[0]
-    return a.strip()
-
-def normalise_title(title: str) -> str:
-    import re
-    t = re.sub(r"\([^)]*version[^)]*\)", "", title or "", flags=re.I)
-    t = re.sub(r"\([^)]*remix[^)]*\)", "", t, flags=re.I)
-    t = re.sub(r"\s+-\s+.*$", "", t)
-    return t.strip()
@@ -0,0 +1,22 @@
+import os
+
+from lyripop.dag import Stage, is_fresh, record, tree_stamp
+
+
+def test_tree_stamp_tracks_layout_not_file_contents(tmp_path):
+    song = tmp_path / "bimmuda_dataset" / "1990" / "1"
+    song.mkdir(parents=True)
+    (song / "a_lyrics.txt").write_text("one")
+    (tmp_path / "metadata.csv").write_text("Title\n")
+    st = Stage("bimmuda", ["true"], inputs=[tmp_path / "metadata.csv"], trees={tmp_path: 3})
+    rec = record(st)
+    assert is_fresh(st, rec)
+
+    (song / "a_lyrics.txt").write_text("edited in place")
+    assert is_fresh(st, rec)
+
+    before = tree_stamp(tmp_path, 3)
+    (song / "b_lyrics.txt").write_text("two")
+    os.utime(song, ns=(1, 1))  # mtime 分辨率粗的文件系统上也保证目录 mtime 变化
+    assert tree_stamp(tmp_path, 3) != before
+    assert not is_fresh(st, rec)
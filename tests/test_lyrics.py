@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pytest
+
+from lyripop import lyrics
+from lyripop.lyrics_cache import LyricsCache, song_key
+
+
+class _Genius(BaseHTTPRequestHandler):
+    """Stand-in for the Genius search API and lyric pages: /search?q=... and /songs/<slug>."""
+
+    songs = {}            # slug -> (title, artist, lyrics or None for a 404 page)
+    unauthorized = False
+    requests = Counter()  # "search" / "page" -> count
+    lock = threading.Lock()
+
+    def do_GET(self):
+        u = urlsplit(self.path)
+        stage = "search" if u.path == "/search" else "page"
+        with self.lock:
+            self.requests[stage] += 1
+        if self.unauthorized:
+            time.sleep(0.05)  # 让排队的任务有机会被取消
+            return self._send(401, b"")
+        base = f"http://{self.headers['Host']}"
+        if stage == "search":
+            q = parse_qs(u.query)["q"][0].lower()
+            hits = [{"result": {"title": t, "primary_artist": {"name": a}, "url": f"{base}/songs/{slug}"}}
+                    for slug, (t, a, _) in self.songs.items() if t.lower() in q]
+            return self._send(200, json.dumps({"response": {"hits": hits}}).encode(), "application/json")
+        lyr = self.songs.get(u.path.rsplit("/", 1)[-1], (None, None, None))[2]
+        if lyr is None:
+            return self._send(404, b"")
+        html = f'<html><body><div data-lyrics-container="true">{"<br/>".join(lyr.splitlines())}</div></body></html>'
+        self._send(200, html.encode(), "text/html; charset=utf-8")
+
+    def _send(self, status, body, ctype="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def genius(monkeypatch):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Genius)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    _Genius.songs = {}; _Genius.unauthorized = False; _Genius.requests = Counter()
+    monkeypatch.setenv("GENIUS_API_BASE", f"http://127.0.0.1:{srv.server_address[1]}")
+    monkeypatch.setenv("GENIUS_ACCESS_TOKEN", "test")
+    lyrics._get_token.cache_clear()
+    yield _Genius
+    srv.shutdown(); srv.server_close()
+    lyrics._get_token.cache_clear()
+
+
+def _chart(titles, artist="Someone"):
+    return pd.DataFrame({"year": 2000, "rank": range(1, len(titles) + 1), "title": titles, "artist": artist})
+
+
+def test_concurrent_fetch_fills_rows_and_cache(genius, tmp_path):
+    genius.songs = {"red-river": ("Red River", "Someone", "red line one\nred line two"),
+                    "blue-moon": ("Blue Moon", "Someone", "blue line"),
+                    "green-light": ("Green Light", "Someone", "green line")}
+    df = _chart(["Red River", "Blue Moon", "Green Light", "Missing One", "Red River"])
+    db = tmp_path / "lyrics.sqlite"
+    out = lyrics.fetch_lyrics_for_chart(df, db, workers=4, rate=0, journal_path=tmp_path / "journal.jsonl")
+
+    base = lyrics._api_base()
+    assert out["rank"].tolist() == [1, 2, 3, 4, 5]
+    assert out["lyrics_raw"].tolist() == ["red line one\nred line two", "blue line", "green line", "",
+                                          "red line one\nred line two"]
+    assert out["lyrics_url"].tolist() == [f"{base}/songs/red-river", f"{base}/songs/blue-moon",
+                                          f"{base}/songs/green-light", "", f"{base}/songs/red-river"]
+    # 同一首歌只抓一次：4 次搜索、3 个歌词页
+    assert genius.requests == Counter(search=4, page=3)
+
+    cache = LyricsCache(db)
+    rows = {k: (lyr, st) for k, lyr, st in cache.db.execute("SELECT key, lyrics, status FROM songs")}
+    charts = cache.db.execute("SELECT COUNT(*) FROM charts").fetchone()[0]
+    cache.close()
+    assert rows == {song_key("Red River", "Someone"): ("red line one\nred line two", "ok"),
+                    song_key("Blue Moon", "Someone"): ("blue line", "ok"),
+                    song_key("Green Light", "Someone"): ("green line", "ok"),
+                    song_key("Missing One", "Someone"): ("", "not_found")}
+    assert charts == 5
+
+    # 重跑全部命中缓存（包括 not_found），不发任何请求
+    again = lyrics.fetch_lyrics_for_chart(df, db, workers=4, rate=0, journal_path=tmp_path / "journal.jsonl")
+    assert genius.requests == Counter(search=4, page=3)
+    pd.testing.assert_frame_equal(again, out)
+
+
+def test_401_stops_after_in_flight_requests(genius, tmp_path):
+    genius.unauthorized = True
+    df = _chart([f"Song {i}" for i in range(200)])
+    workers = 4
+    with pytest.raises(RuntimeError, match="401"):
+        lyrics.fetch_lyrics_for_chart(df, tmp_path / "lyrics.sqlite", workers=workers, rate=0,
+                                      journal_path=tmp_path / "journal.jsonl")
+    # 第一个 401 之后只剩在途请求完成，排队的歌曲全部取消
+    assert genius.requests["search"] <= 2 * workers
+
+
+def test_expired_not_found_is_searched_again(genius, tmp_path):
+    genius.songs = {"gone": ("Gone", "Someone", None)}
+    df = _chart(["Gone"])
+    kw = dict(workers=2, rate=0, journal_path=tmp_path / "journal.jsonl")
+    out = lyrics.fetch_lyrics_for_chart(df, tmp_path / "lyrics.sqlite", **kw)
+    assert out.loc[0, "lyrics_raw"] == "" and genius.requests["search"] == 1
+    # 跑完后日志只留未完成的命中：这首歌已有结论，日志为空，完整记录在 .1
+    assert (tmp_path / "journal.jsonl").read_text() == ""
+    assert "not_found" in (tmp_path / "journal.jsonl.1").read_text()
+
+    genius.songs["gone"] = ("Gone", "Someone", "back again")
+    out = lyrics.fetch_lyrics_for_chart(df, tmp_path / "lyrics.sqlite", negative_ttl=0, **kw)
+    assert genius.requests["search"] == 2
+    assert out.loc[0, "lyrics_raw"] == "back again"
@@ -0,0 +1,54 @@
+import math
+import random
+
+import numpy as np
+
+from lyripop.mxm import METRIC_COLS, _parse_bow_lines, bow_metrics
+
+
+def _bow_stats(pairs):
+    # 逐曲目的标量参考实现（旧版 mxm_hot100_compare.bow_stats），bow_metrics 必须与它逐位一致
+    total = 0; counts = []
+    for pc in pairs:
+        try:
+            _, c = pc.split(":")
+            c = int(c)
+            if c > 0:
+                counts.append(c); total += c
+        except Exception:
+            pass
+    if total == 0:
+        return dict(total=0, ttr=0.0, entropy=0.0, hhi=0.0, max_p=0.0)
+    ps = [c/total for c in counts]
+    entropy = -sum(p*math.log(p+1e-12) for p in ps)
+    hhi = sum(p*p for p in ps)
+    max_p = max(ps)
+    ttr = len(counts)/total
+    return dict(total=total, ttr=ttr, entropy=entropy, hhi=hhi, max_p=max_p)
+
+
+def test_bow_metrics_match_scalar_reference():
+    rng = random.Random(0)
+    lines = [
+        "TR1,1,1:3,2:1,7:1",                # 标准行
+        "TR2,2,5:1",                         # 单个词
+        "TR3,3,1:0,2:0",                     # 全部 count 为 0
+        "TR4,4,1:2,2:0,3:2",                 # 夹着 0
+        "TR5,5,a:b,3:x,4:,:4,9:1:1,6:2",    # 非法段
+        "TR6,6,1:1,2:1,3:1,4:1",             # 相同的 p
+    ]
+    lines += [f"TRR{i},{i}," + ",".join(f"{w}:{rng.randint(0, 40)}" for w in rng.sample(range(1, 5001), rng.randint(1, 60)))
+              for i in range(300)]
+    tids, indptr, _, count = _parse_bow_lines(lines)
+    got = bow_metrics(indptr, count)
+
+    ref = []
+    for line in lines:
+        tid, rest = line.split(",", 1)
+        pairs = [seg for seg in rest.split(",") if ":" in seg]
+        if pairs:
+            ref.append((tid, _bow_stats(pairs)))
+    assert list(tids) == [t for t, _ in ref]
+    for col in METRIC_COLS:
+        want = np.array([s[col] for _, s in ref])
+        assert np.array_equal(got[col].to_numpy(), want), col
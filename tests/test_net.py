@@ -0,0 +1,21 @@
+import requests
+
+from lyripop.net import Cassette
+
+
+def _response(status, body=b""):
+    r = requests.Response()
+    r.status_code, r._content, r.url = status, body, "https://example.org/chart"
+    return r
+
+
+def test_304_does_not_replace_recorded_body(tmp_path):
+    cas = Cassette(tmp_path, "record")
+    key = Cassette.key("https://example.org/chart")
+    cas.record(key, _response(200, b"<html>chart</html>"))
+    cas.record(key, _response(304))
+    cas.close()
+    cas = Cassette(tmp_path, "replay")
+    r = cas.replay(key, "https://example.org/chart")
+    cas.close()
+    assert (r.status_code, r.text) == (200, "<html>chart</html>")